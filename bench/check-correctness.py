@@ -0,0 +1,232 @@
+#! /usr/bin/env python
+# Copyright 2016 Martin C. Frith
+
+# Make synthetic data with make-synthetic-data.py, run the scripts on
+# it, and check that: the planted rearrangements are found, the planted
+# gap-fills and end-joins aren't, the reference-supported ones are kept
+# by supported-rearrangements.py, the planted retrosequences are
+# removed by rearrangement-retrofilter.py (and shown by its --show),
+# rearrangement-pipeline.py agrees, -f tsv output converts back to the
+# same text, genome-rearrangements.py's other options and compressed
+# inputs give the same rearrangements, and (for the default data) the
+# outputs equal the files in golden/.
+
+from __future__ import print_function
+
+import optparse, os, shutil, subprocess, sys, tempfile
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+scriptDir = os.path.dirname(benchDir)
+goldenDir = os.path.join(benchDir, "golden")
+sys.path.insert(0, scriptDir)
+import rearrangementutils as U
+
+reportedTypes = "inversion", "translocation", "retro"
+
+# Outputs of genome-rearrangements.py that should equal detect.txt
+sameAsDetect = [("jobs.txt", "-j 2"),
+                ("maxMemory.txt", "-M"),
+                ("cacheCold.txt", "-c, cold"),
+                ("cacheWarm.txt", "-c, warm"),
+                ("sortBuffer.txt", "-b"),
+                ("sweep.txt", "--sweep-mismap/--sweep-distance"),
+                ("batch.txt", "--batch"),
+                ("gzip.txt", "gzip input"),
+                ("bgzf.txt", "BGZF input")]
+
+region = "top.chr1", 50000, 100000
+
+def run(scriptName, args, outFileName):
+    script = os.path.join(scriptDir, scriptName)
+    out = open(outFileName, "w")
+    subprocess.check_call([sys.executable, script] + args, stdout=out)
+    out.close()
+    return readLines(outFileName)
+
+def readLines(fileName):
+    return [i.rstrip("\n") for i in open(fileName)]
+
+def readPlanted(fileName):
+    for line in open(fileName):
+        if line[0] == "#": continue
+        eventType, isShared, edges = line.rstrip("\n").split("\t")
+        yield eventType, isShared == "1", frozenset(edges.split())
+
+def topEdges(line):
+    return frozenset(i for i in line.split() if i.startswith("top."))
+
+def plantedLines(events, lines):
+    # The output line for each reported event, in output order
+    lineOfEdges = dict((topEdges(i), i) for i in lines)
+    out = set(lineOfEdges.get(e[2]) for e in events)
+    return [i for i in lines if i in out]
+
+def isInRegion(line):
+    name, beg, end = region
+    for i in line.split():
+        if ":" in i:
+            seqName, coordinate = i[:-1].rsplit(":", 1)
+            if seqName == name and beg <= int(coordinate) <= end: return True
+    return False
+
+def check(results, description, isOk):
+    results.append(isOk)
+    print("ok" if isOk else "FAIL", description, sep="\t")
+
+def checkPlanted(results, events, outputs):
+    reported = [i for i in events if i[0] in reportedTypes]
+    rejected = [i for i in events if i[0] not in reportedTypes]
+    found = outputs["detect.txt"]
+    foundEdges = [topEdges(i) for i in found]
+    for eventType, isShared, edges in reported:
+        check(results, "found %s %s" % (eventType, min(edges)),
+              foundEdges.count(edges) == 1)
+    check(results, "no unplanted rearrangements",
+          len(found) == len(reported) == len(set(foundEdges)))
+    allFoundEdges = set().union(*foundEdges) if found else set()
+    for eventType, isShared, edges in rejected:
+        check(results, "rejected %s %s" % (eventType, min(edges)),
+              not edges & allFoundEdges)
+    shared = [i for i in reported if i[1]]
+    check(results, "supported-rearrangements.py keeps the shared ones",
+          outputs["supported.txt"] == plantedLines(shared, found))
+    retros = [i for i in reported if i[0] == "retro"]
+    retroNames = set(i.split("\t")[1] for i in outputs["retros.tab"]
+                     if not i.startswith("#"))
+    check(results, "last-spliced-retroseqs.py finds the retrosequences",
+          all("NM_retro%d" % i in retroNames for i in range(len(retros))))
+    nonRetros = [i for i in reported if i[0] != "retro"]
+    check(results, "rearrangement-retrofilter.py removes the retrosequences",
+          outputs["retrofilter.txt"] == plantedLines(nonRetros, found))
+    check(results, "-f tsv output converts to the same text",
+          outputs.pop("converted.txt") == found)
+    sharedNonRetros = [i for i in shared if i[0] != "retro"]
+    check(results, "rearrangement-pipeline.py agrees",
+          outputs["pipeline.txt"] == plantedLines(sharedNonRetros, found))
+
+def checkVariants(results, outputs):
+    # These aren't in golden/: they should agree with detect.txt
+    found = outputs["detect.txt"]
+    for name, description in sameAsDetect:
+        check(results, "genome-rearrangements.py %s agrees" % description,
+              outputs.pop(name) == found)
+    check(results, "genome-rearrangements.py -u agrees, unsorted",
+          sorted(outputs.pop("unsorted.txt")) == sorted(found))
+    check(results, "genome-rearrangements.py --region agrees",
+          outputs.pop("region.txt") == [i for i in found if isInRegion(i)])
+    shown = set(i.split(" ", 2)[2] for i in outputs.pop("retroshow.txt"))
+    removed = [i for i in found if i not in outputs["retrofilter.txt"]]
+    check(results, "rearrangement-retrofilter.py --show shows the removed ones",
+          sorted(shown) == sorted(removed))
+
+def runAll(tmpDir):
+    d = os.path.join(tmpDir, "syn")
+    g = ["-1", d + ".gap1", "-2", d + ".gap2"]
+    outputs = {}
+    def out(name): return os.path.join(tmpDir, name)
+    outputs["detect.txt"] = run("genome-rearrangements.py",
+                                g + [d + ".maf"], out("detect.txt"))
+    run("genome-rearrangements.py", ["-f", "tsv"] + g + [d + ".maf"],
+        out("detect.tsv"))
+    outputs["converted.txt"] = run("rearrangement-convert.py",
+                                   [out("detect.tsv")], out("converted.txt"))
+    outputs["supported.txt"] = run("supported-rearrangements.py",
+                                   [d + ".ref", out("detect.txt")],
+                                   out("supported.txt"))
+    outputs["retros.tab"] = run("last-spliced-retroseqs.py",
+                                [d + ".psl", d + ".tab"], out("retros.tab"))
+    outputs["retrofilter.txt"] = run("rearrangement-retrofilter.py",
+                                     ["-g", "top", out("retros.tab"),
+                                      out("detect.txt")],
+                                     out("retrofilter.txt"))
+    outputs["pipeline.txt"] = run("rearrangement-pipeline.py",
+                                  g + ["-r", d + ".ref", "-g", "top",
+                                       "--genes", d + ".psl", "--last",
+                                       d + ".tab", d + ".maf"],
+                                  out("pipeline.txt"))
+    outputs["retroshow.txt"] = run("rearrangement-retrofilter.py",
+                                   ["-s", "-g", "top", out("retros.tab"),
+                                    out("detect.txt")], out("retroshow.txt"))
+    runVariants(tmpDir, outputs)
+    return outputs
+
+def runVariants(tmpDir, outputs):
+    d = os.path.join(tmpDir, "syn")
+    g = ["-1", d + ".gap1", "-2", d + ".gap2"]
+    def out(name): return os.path.join(tmpDir, name)
+    def detect(name, args):
+        outputs[name] = run("genome-rearrangements.py", g + args, out(name))
+    detect("jobs.txt", ["-j", "2", d + ".maf"])
+    detect("maxMemory.txt", ["-M", "1K", d + ".maf"])
+    detect("cacheCold.txt", ["-c", out("cache"), d + ".maf"])
+    detect("cacheWarm.txt", ["-c", out("cache"), d + ".maf"])
+    detect("unsorted.txt", ["-u", d + ".maf"])
+    detect("sortBuffer.txt", ["-b", "2", d + ".maf"])
+    detect("region.txt", ["--region", "%s:%d-%d" % region, d + ".maf"])
+    # The sweep includes the default limits, whose file should match
+    run("genome-rearrangements.py", g + ["--sweep-mismap", "1e-10,1e-5,1",
+                                         "--sweep-distance", "1000,1e9",
+                                         "--sweep-prefix", out("sweep"),
+                                         d + ".maf"], out("sweep.log"))
+    outputs["sweep.txt"] = readLines(out("sweep.m1e-05.d1e+09.txt"))
+    with open(out("batch.in"), "w") as f:
+        f.write("%s %s %s\n" % (d + ".maf", d + ".gap2", out("batch.txt")))
+    run("genome-rearrangements.py", ["-1", d + ".gap1", "--batch",
+                                     out("batch.in")], out("batch.log"))
+    outputs["batch.txt"] = readLines(out("batch.txt"))
+    U.writeGzip(d + ".maf", out("syn.maf.gz"))
+    detect("gzip.txt", [out("syn.maf.gz")])
+    U.writeBgzf(d + ".maf", out("syn.maf.bgz"))
+    detect("bgzf.txt", [out("syn.maf.bgz")])
+
+def checkGolden(results, outputs, isUpdate):
+    for name in sorted(outputs):
+        fileName = os.path.join(goldenDir, name)
+        if isUpdate:
+            if not os.path.isdir(goldenDir): os.makedirs(goldenDir)
+            with open(fileName, "w") as f:
+                f.writelines(i + "\n" for i in outputs[name])
+        golden = [i.rstrip("\n") for i in open(fileName)]
+        check(results, "%s equals golden/%s" % (name, name),
+              outputs[name] == golden)
+
+def checkCorrectness(opts, args):
+    tmpDir = tempfile.mkdtemp()
+    try:
+        generator = os.path.join(benchDir, "make-synthetic-data.py")
+        subprocess.check_call([sys.executable, generator,
+                               "-n", str(opts.alignments), "-s", str(opts.seed),
+                               os.path.join(tmpDir, "syn")])
+        events = list(readPlanted(os.path.join(tmpDir, "syn.planted")))
+        outputs = runAll(tmpDir)
+        results = []
+        checkPlanted(results, events, outputs)
+        checkVariants(results, outputs)
+        isDefault = (opts.alignments, opts.seed) == (op.defaults["alignments"],
+                                                      op.defaults["seed"])
+        if isDefault: checkGolden(results, outputs, opts.update)
+        if opts.keep:
+            if os.path.exists(opts.keep): shutil.rmtree(opts.keep)
+            shutil.copytree(tmpDir, opts.keep)
+    finally:
+        shutil.rmtree(tmpDir)
+    print(results.count(True), "ok,", results.count(False), "failed")
+    return all(results)
+
+if __name__ == "__main__":
+    usage = "%prog [options]"
+    description = "Check the scripts on synthetic data with planted rearrangements."
+    op = optparse.OptionParser(usage=usage, description=description)
+    op.add_option("-n", "--alignments", metavar="N", type="int", default=2000,
+                  help="about this many alignments (default: %default)")
+    op.add_option("-s", "--seed", metavar="N", type="int", default=1,
+                  help="random seed (default: %default)")
+    op.add_option("-k", "--keep", metavar="DIR",
+                  help="keep the data and outputs in DIR")
+    op.add_option("--update", action="store_true",
+                  help="rewrite the golden files (default data only)")
+    opts, args = op.parse_args()
+    if args: op.error("I don't take any file names")
+    if opts.update and (opts.alignments, opts.seed) != (2000, 1):
+        op.error("option --update needs the default data")
+    sys.exit(0 if checkCorrectness(opts, args) else 1)
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# Copyright 2016 Martin C. Frith
+
+# Check that findEquivalentEdges in supported-rearrangements.py pairs
+# the same edges as the old recursive version (below), on random pairs
+# of edge lists, with many equal coordinates.
+
+from __future__ import print_function
+
+import optparse, os, random, sys
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchDir))
+import rearrangements as R
+
+def oldFindEquivalentEdges(edges1, edges2, maxDistance):
+    # The version before the heap.  It recurses on slices, so here each
+    # edge has its original index as a fourth item, and the third item
+    # of paired edges is set to their partner's original index.
+    minDistance = maxDistance + 1
+    i1best = -1
+    i2best = -1
+    beg2 = 0
+    for i1, e1 in enumerate(edges1):
+        coordinate1, isStart1 = e1[:2]
+        i2 = beg2
+        while i2 < len(edges2):
+            e2 = edges2[i2]
+            coordinate2, isStart2 = e2[:2]
+            if isStart1 == isStart2:
+                distance = abs(coordinate1 - coordinate2)
+                if distance < minDistance:
+                    minDistance = distance
+                    i1best = i1
+                    i2best = i2
+                if coordinate2 <= coordinate1: beg2 = i2 + 1
+                if coordinate2 >= coordinate1: break
+            i2 += 1
+    if minDistance <= maxDistance:
+        edges1[i1best][2] = edges2[i2best][3]
+        edges2[i2best][2] = edges1[i1best][3]
+        oldFindEquivalentEdges(edges1[:i1best], edges2[:i2best], maxDistance)
+        i1next = i1best + 1
+        i2next = i2best + 1
+        oldFindEquivalentEdges(edges1[i1next:], edges2[i2next:], maxDistance)
+
+def randomEdges(maxLength, span):
+    n = random.randint(0, maxLength)
+    return sorted([random.randrange(span), random.random() < 0.5, -1]
+                  for i in range(n))
+
+def pairs(edges):
+    # The (own index, partner index) of each paired edge
+    return [(i, e[2]) for i, e in enumerate(edges) if e[2] >= 0]
+
+def isSamePairs(edges1, edges2, maxDistance):
+    old1 = [e + [i] for i, e in enumerate(edges1)]
+    old2 = [e + [i] for i, e in enumerate(edges2)]
+    oldFindEquivalentEdges(old1, old2, maxDistance)
+    new1 = [e[:] for e in edges1]
+    new2 = [e[:] for e in edges2]
+    R.supportScript.findEquivalentEdges(new1, new2, maxDistance)
+    return pairs(old1) == pairs(new1) and pairs(old2) == pairs(new2)
+
+def checkEquivalentEdges(opts):
+    random.seed(opts.seed)
+    distances = 0, 1, 5, 20, 1e9
+    failures = 0
+    for i in range(opts.trials):
+        span = random.choice((5, 20, 100, 1000))
+        edges1 = randomEdges(opts.length, span)
+        edges2 = randomEdges(opts.length, span)
+        maxDistance = random.choice(distances)
+        if not isSamePairs(edges1, edges2, maxDistance):
+            failures += 1
+            if failures == 1:
+                print("FAIL", "maxDistance=%s" % maxDistance, edges1, edges2,
+                      sep="\n")
+    print(opts.trials - failures, "ok,", failures, "failed")
+    return not failures
+
+if __name__ == "__main__":
+    usage = "%prog [options]"
+    description = "Compare findEquivalentEdges' pairs with the old recursive version's on random edges."
+    op = optparse.OptionParser(usage=usage, description=description)
+    op.add_option("-n", "--trials", metavar="N", type="int", default=20000,
+                  help="number of random pairs of edge lists (default: %default)")
+    op.add_option("-l", "--length", metavar="N", type="int", default=40,
+                  help="at most N edges per list (default: %default)")
+    op.add_option("-s", "--seed", metavar="N", type="int", default=1,
+                  help="random seed (default: %default)")
+    opts, args = op.parse_args()
+    if args: op.error("I don't take any file names")
+    sys.exit(0 if checkEquivalentEdges(opts) else 1)
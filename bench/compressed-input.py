@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+# Copyright 2016 Martin C. Frith
+
+# Time genome-rearrangements.py on a MAF file, and on gzip and BGZF
+# copies of it, and check that the outputs are the same.
+
+from __future__ import print_function
+
+import optparse, os, shutil, subprocess, sys, tempfile, time
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchDir))
+import rearrangementutils as U
+
+def readSeconds(fileName):
+    # Time reading the (decompressed) bytes, as the MAF parser does
+    beg = time.time()
+    f = U.myOpenBytes(fileName)
+    while f.read(1 << 24):
+        pass
+    return time.time() - beg
+
+def runSeconds(opts, fileName):
+    script = os.path.join(os.path.dirname(benchDir), "genome-rearrangements.py")
+    args = [sys.executable, script, fileName]
+    if opts.gap1: args[2:2] = ["-1", opts.gap1]
+    if opts.gap2: args[2:2] = ["-2", opts.gap2]
+    beg = time.time()
+    out = subprocess.check_output(args)
+    return time.time() - beg, out
+
+def compressedInputBenchmark(opts, args):
+    tmpDir = tempfile.mkdtemp()
+    try:
+        plain = args[0]
+        gz = os.path.join(tmpDir, "in.maf.gz")
+        bgz = os.path.join(tmpDir, "in.maf.bgz")
+        U.writeGzip(plain, gz)
+        U.writeBgzf(plain, bgz)
+        print("#input", "bytes", "readSeconds", "runSeconds", sep="\t")
+        outputs = []
+        for name, fileName in ("plain", plain), ("gzip", gz), ("bgzf", bgz):
+            read = min(readSeconds(fileName) for i in range(opts.repeats))
+            runs = [runSeconds(opts, fileName) for i in range(opts.repeats)]
+            outputs.append(runs[0][1])
+            run = min(i[0] for i in runs)
+            print(name, os.path.getsize(fileName), "%.3f" % read, "%.3f" % run,
+                  sep="\t")
+        if outputs.count(outputs[0]) != len(outputs):
+            raise Exception("the outputs differ")
+    finally:
+        shutil.rmtree(tmpDir)
+
+if __name__ == "__main__":
+    usage = "%prog [options] alignments.maf"
+    description = "Time genome-rearrangements.py on plain, gzip, and BGZF copies of a MAF file."
+    op = optparse.OptionParser(usage=usage, description=description)
+    op.add_option("-1", "--gap1", metavar="FILE",
+                  help="read genome1 assembly gaps from agp or gap file")
+    op.add_option("-2", "--gap2", metavar="FILE",
+                  help="read genome2 assembly gaps from agp or gap file")
+    op.add_option("-r", "--repeats", metavar="N", type="int", default=3,
+                  help="report the fastest of N runs (default: %default)")
+    opts, args = op.parse_args()
+    if len(args) != 1: op.error("I need 1 file name")
+    compressedInputBenchmark(opts, args)
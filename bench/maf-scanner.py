@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+# Copyright 2016 Martin C. Frith
+
+# Time reading the alignment edges of MAF files with
+# genome-rearrangements.py's byte scanner, and with the old generator
+# (below) that split each line, and check that they get the same
+# edges.  Without file names, it makes pairwise MAF files with short
+# (50-2000 bp) and long (50-20000 bp) alignments.
+
+from __future__ import print_function
+
+import optparse, os, random, shutil, sys, tempfile, time
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchDir))
+import rearrangements as R
+
+def isReliableMaf(aLine, maxMismap):
+    for i in aLine.split():
+        x = i.split("=")
+        if len(x) > 1 and x[0] == "mismap":
+            return float(x[1]) <= maxMismap
+    return True
+
+# This is the old generator, which split each line of text
+def alignmentEdgesFromMaf(lines, maxMismap):
+    i = 0  # serial number for alignment ends
+    for line in lines:
+        if line[0] == "a":
+            genomeNumber = 0
+            isWanted = isReliableMaf(line, maxMismap)
+        if line[0] == "s" and isWanted:
+            genomeNumber += 1
+            s, seqName, beg, span, strand, seqLen, aln = line.split(None, 6)
+            if strand == "+":
+                beg = int(beg)
+                end = beg + int(span)
+                begType = "start"
+                endType = "end"
+            else:
+                beg = int(seqLen) - int(beg)
+                end = beg - int(span)
+                begType = "end"
+                endType = "start"
+            if genomeNumber == 1:
+                yield [i+0, 1, seqName, beg, begType, i+1]
+                yield [i+2, 1, seqName, end, endType, i+3]
+            if genomeNumber == 2:
+                yield [i+1, 2, seqName, beg, begType, i+0]
+                yield [i+3, 2, seqName, end, endType, i+2]
+                i += 4
+
+def oldEdges(fileName, maxMismap):
+    return list(alignmentEdgesFromMaf(open(fileName), maxMismap))
+
+def newEdges(fileName, maxMismap):
+    return R.genomeScript.edgeTableFromMaf(fileName, maxMismap)
+
+def isSameEdges(oldEdges, table):
+    old = sorted((e[0], e[2], e[3], e[4] == "start") for e in oldEdges)
+    new = [(i, table.seqNames[table.seqIds[i]], table.coords[i],
+            table.isStarts[i] == 1) for i in range(len(table))]
+    return old == new
+
+def writeMaf(fileName, numOfBytes, maxLength):
+    pool = "".join(random.choice("ACGT") for i in range(1 << 16))
+    out = open(fileName, "w")
+    size = 0
+    while size < numOfBytes:
+        length = random.randint(50, maxLength)
+        off = random.randrange(len(pool) - maxLength)
+        seq = pool[off:off + length]
+        mismap = random.choice(("1e-10", "1e-06", "0.001", "0.1"))
+        strand = random.choice("+-")
+        chrom = random.randint(1, 20)
+        beg1 = random.randrange(100000000)
+        beg2 = random.randrange(100000000)
+        block = ("a score=%d mismap=%s\n" % (length * 5, mismap) +
+                 "s top.chr%d %d %d + 200000000 %s\n" %
+                 (chrom, beg1, length, seq) +
+                 "s bot.chr%d %d %d %s 200000000 %s\n\n" %
+                 (chrom, beg2, length, strand, seq))
+        out.write(block)
+        size += len(block)
+    out.close()
+
+# CPU time is less noisy than wall time on a busy machine
+if hasattr(time, "process_time"): cpuSeconds = time.process_time
+else: cpuSeconds = time.clock  # python2
+
+def bestSeconds(functions, repeats):
+    # Alternate the functions, so that they see the same machine load
+    times = [[] for f in functions]
+    for i in range(repeats):
+        results = []
+        for f, t in zip(functions, times):
+            beg = cpuSeconds()
+            results.append(f())
+            t.append(cpuSeconds() - beg)
+    return [min(t) for t in times], results
+
+def benchmarkFile(opts, fileName):
+    megabytes = os.path.getsize(fileName) / 1e6
+    functions = (lambda: oldEdges(fileName, opts.mismap),
+                 lambda: newEdges(fileName, opts.mismap))
+    (oldSeconds, newSeconds), (old, new) = bestSeconds(functions, opts.repeats)
+    isSame = isSameEdges(old, new)
+    print(os.path.basename(fileName), "%.1f" % megabytes,
+          "%.0f" % (megabytes / oldSeconds), "%.0f" % (megabytes / newSeconds),
+          "%.2f" % (oldSeconds / newSeconds), "ok" if isSame else "DIFFERENT",
+          sep="\t")
+    return isSame
+
+def mafScannerBenchmark(opts, args):
+    print("#file", "MB", "oldMB/s", "newMB/s", "speedup", "check", sep="\t")
+    if args: return all([benchmarkFile(opts, i) for i in args])
+    random.seed(opts.seed)
+    tmpDir = tempfile.mkdtemp()
+    try:
+        results = []
+        for name, maxLength in ("short.maf", 2000), ("long.maf", 20000):
+            fileName = os.path.join(tmpDir, name)
+            writeMaf(fileName, opts.megabytes * 1000000, maxLength)
+            results.append(benchmarkFile(opts, fileName))
+    finally:
+        shutil.rmtree(tmpDir)
+    return all(results)
+
+if __name__ == "__main__":
+    usage = "%prog [options] [maf-file(s)]"
+    description = "Time the MAF byte scanner against the old line-splitting generator."
+    op = optparse.OptionParser(usage=usage, description=description)
+    op.add_option("-m", "--mismap", metavar="PROB", type="float", default=1e-5,
+                  help="omit alignments with mismap probability > PROB (default: %default)")
+    op.add_option("-b", "--megabytes", metavar="N", type="int", default=40,
+                  help="size of each made MAF file (default: %default)")
+    op.add_option("-r", "--repeats", metavar="N", type="int", default=9,
+                  help="report the fastest of N runs (default: %default)")
+    op.add_option("-s", "--seed", metavar="N", type="int", default=1,
+                  help="random seed (default: %default)")
+    opts, args = op.parse_args()
+    sys.exit(0 if mafScannerBenchmark(opts, args) else 1)
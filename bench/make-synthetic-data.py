@@ -0,0 +1,365 @@
+#! /usr/bin/env python
+# Copyright 2016 Martin C. Frith
+
+# Make a one-to-one alignment of two synthetic genomes, "top" and
+# "bot", with planted rearrangements, and matching inputs for the
+# other scripts:
+#   PREFIX.maf      the alignment
+#   PREFIX.gap1     top genome assembly gaps, in gap.txt format
+#   PREFIX.gap2     bot genome assembly gaps
+#   PREFIX.ref      reference rearrangements, sharing some planted ones
+#   PREFIX.psl      gene annotations
+#   PREFIX.tab      RNA-to-genome alignments, in LAST tabular format
+#   PREFIX.planted  the planted events, and their top genome edges
+#
+# The bot genome has the same coordinates as the top genome, except
+# where events are planted.  Planted events:
+#   inversion      a few segments, reversed in bot
+#   translocation  a few segments, moved into a hole in another
+#                  chromosome in bot
+#   retro          a translocation of one segment, which is also a
+#                  spliced retrosequence, so rearrangement-retrofilter.py
+#                  should remove it
+#   gapfill        a top fragment (chrUn_g*) that fills a top gap in bot,
+#                  which genome-rearrangements.py should reject
+#   endjoin        two top fragments (chrUn_e*) joined in bot, which
+#                  genome-rearrangements.py should reject
+#
+# It only uses random(), not randint etc., so the output is the same
+# in python 2 and 3.
+
+from __future__ import print_function
+
+import array, optparse, random
+
+holeMargin = 100
+
+def randInt(r, beg, end):  # like randint: beg <= x <= end
+    return beg + int(r.random() * (end - beg + 1))
+
+def randItem(r, items):
+    return items[int(r.random() * len(items))]
+
+class Genomes(object):
+    def __init__(self):
+        self.names = []    # top chromosome names
+        self.lengths = []  # their lengths: bot chromosomes are the same
+        self.begs = []     # each chromosome's segment starts, in an array
+        self.sizes = []    # each chromosome's segment sizes, in an array
+        self.holes = []    # each chromosome's list of big spacers
+        self.used = []     # each chromosome's segments used by events
+        self.botPlaces = {}  # (chrom, segment) -> bot (name, beg, strand)
+        self.fragments = []  # top fragments: (name, length, segments)
+        self.botContigs = {}  # extra bot sequence lengths
+        self.gaps1 = []
+        self.gaps2 = []
+        self.retros = []   # (chrom, beg, end) of planted retrosequences
+        self.events = []   # (type, isShared, top edges)
+
+def layOutChromosome(r, g, name, numOfSegments, holeRate):
+    begs = array.array("l")
+    sizes = array.array("l")
+    holes = []
+    pos = randInt(r, 0, 500)
+    for i in range(numOfSegments):
+        begs.append(pos)
+        sizes.append(randInt(r, 200, 2000))
+        pos += sizes[-1]
+        if r.random() < holeRate and 1 < i < numOfSegments - 2:
+            holes.append(i)  # the spacer after segment i
+            pos += randInt(r, 3000, 8000)
+        else:
+            pos += randInt(r, 0, 200)
+    g.names.append(name)
+    g.lengths.append(pos + randInt(r, 0, 500))
+    g.begs.append(begs)
+    g.sizes.append(sizes)
+    g.holes.append(holes)
+    g.used.append(bytearray(numOfSegments))
+
+def segmentEnd(g, c, i):
+    return g.begs[c][i] + g.sizes[c][i]
+
+def topEdge(name, coordinate, isStart):
+    return "top.%s:%d%s" % (name, coordinate, "[" if isStart else "]")
+
+def junctionEdges(g, c, i):  # top edges between segments i and i+1
+    name = g.names[c]
+    return [topEdge(name, segmentEnd(g, c, i), False),
+            topEdge(name, g.begs[c][i + 1], True)]
+
+def windowEdges(g, c, i, j):  # top edges around segments i to j-1
+    return junctionEdges(g, c, i - 1) + junctionEdges(g, c, j - 1)
+
+def isFree(g, c, beg, end):
+    used = g.used[c]
+    return 0 <= beg and end <= len(used) and not any(used[beg:end])
+
+def markUsed(g, c, beg, end):
+    for i in range(beg, end):
+        g.used[c][i] = 1
+
+def freeWindow(r, g, c, width):
+    # Find segments i to i+width-1, with 2 free segments either side
+    n = len(g.used[c])
+    for t in range(10):
+        i = randInt(r, 2, n - width - 2)
+        if isFree(g, c, i - 2, i + width + 2): return i
+    return None
+
+def freeHole(r, g, c, minLength):
+    holes = g.holes[c]
+    for t in range(10):
+        if not holes: return None
+        k = int(r.random() * len(holes))
+        i = holes[k]
+        holeLength = g.begs[c][i + 1] - segmentEnd(g, c, i)
+        if holeLength >= minLength and isFree(g, c, i - 1, i + 3):
+            holes.pop(k)
+            return i
+    return None
+
+def plantInversion(r, g, isShared):
+    c = int(r.random() * len(g.names))
+    width = randInt(r, 1, 4)
+    i = freeWindow(r, g, c, width)
+    if i is None: return
+    markUsed(g, c, i - 1, i + width + 1)
+    j = i + width
+    windowBeg = g.begs[c][i]
+    windowEnd = segmentEnd(g, c, j - 1)
+    for k in range(i, j):
+        botBeg = windowBeg + windowEnd - segmentEnd(g, c, k)
+        g.botPlaces[c, k] = g.names[c], botBeg, "-"
+    g.events.append(("inversion", isShared, windowEdges(g, c, i, j)))
+
+def plantTranslocation(r, g, isShared, isRetro):
+    c = int(r.random() * len(g.names))
+    d = int(r.random() * len(g.names))
+    if c == d: return
+    width = 1 if isRetro else randInt(r, 1, 3)
+    i = freeWindow(r, g, c, width)
+    if i is None: return
+    j = i + width
+    windowBeg = g.begs[c][i]
+    windowEnd = segmentEnd(g, c, j - 1)
+    h = freeHole(r, g, d, windowEnd - windowBeg + 2 * holeMargin)
+    if h is None: return
+    markUsed(g, c, i - 1, j + 1)
+    markUsed(g, d, h, h + 2)
+    botBeg = segmentEnd(g, d, h) + holeMargin - windowBeg
+    for k in range(i, j):
+        g.botPlaces[c, k] = g.names[d], botBeg + g.begs[c][k], "+"
+    edges = windowEdges(g, c, i, j) + junctionEdges(g, d, h)
+    if isRetro:
+        g.retros.append((g.names[c], segmentEnd(g, c, i - 1), g.begs[c][j]))
+        g.events.append(("retro", isShared, edges))
+    else:
+        g.events.append(("translocation", isShared, edges))
+
+def plantGapFill(r, g):
+    c = int(r.random() * len(g.names))
+    h = freeHole(r, g, c, 0)
+    if h is None: return
+    markUsed(g, c, h, h + 2)
+    holeBeg = segmentEnd(g, c, h)
+    holeEnd = g.begs[c][h + 1]
+    g.gaps1.append((g.names[c], holeBeg + 10, holeEnd - 10))
+    size = randInt(r, 200, holeEnd - holeBeg - 2 * holeMargin)
+    name = "chrUn_g%d" % len(g.fragments)
+    g.fragments.append((name, size + 2 * holeMargin, [(holeMargin, size)]))
+    g.botPlaces[name, 0] = g.names[c], holeBeg + holeMargin, "+"
+    edges = junctionEdges(g, c, h)
+    edges += [topEdge(name, holeMargin, True),
+              topEdge(name, holeMargin + size, False)]
+    g.events.append(("gapfill", False, edges))
+
+def plantEndJoin(r, g):
+    botName = "chrUn_j%d" % len(g.botContigs)
+    botPos = randInt(r, 0, 500)
+    edges = []
+    for f in range(2):
+        name = "chrUn_e%d" % len(g.fragments)
+        pos = randInt(r, 0, 500)
+        segments = []
+        for k in range(randInt(r, 1, 2)):
+            size = randInt(r, 200, 2000)
+            g.botPlaces[name, k] = botName, botPos, "+"
+            segments.append((pos, size))
+            pos += size + randInt(r, 0, 200)
+            botPos += size + randInt(r, 0, 200)
+        g.fragments.append((name, pos + randInt(r, 0, 500), segments))
+        if f: edges.append(topEdge(name, segments[0][0], True))
+        else: edges.append(topEdge(name, sum(segments[-1]), False))
+    g.botContigs[botName] = botPos + randInt(r, 0, 500)
+    g.events.append(("endjoin", False, edges))
+
+def plantEvents(r, g, numOfEvents):
+    for e in range(numOfEvents):
+        x = r.random()
+        isShared = r.random() < 0.5
+        if   x < 0.3:  plantInversion(r, g, isShared)
+        elif x < 0.5:  plantTranslocation(r, g, isShared, False)
+        elif x < 0.65: plantTranslocation(r, g, isShared, True)
+        elif x < 0.8:  plantGapFill(r, g)
+        else:          plantEndJoin(r, g)
+
+def addRandomGaps(r, g, gapRate):
+    # Put gaps in spacers between unused segments, in either genome
+    for c, name in enumerate(g.names):
+        begs = g.begs[c]
+        sizes = g.sizes[c]
+        used = g.used[c]
+        for i in range(len(begs) - 1):
+            spacerBeg = begs[i] + sizes[i] + 5
+            spacerEnd = begs[i + 1] - 5
+            if used[i] or used[i + 1] or spacerEnd - spacerBeg < 10: continue
+            if r.random() < gapRate: g.gaps1.append((name, spacerBeg, spacerEnd))
+            if r.random() < gapRate: g.gaps2.append((name, spacerBeg, spacerEnd))
+
+def botLength(g, name):
+    if name in g.botContigs: return g.botContigs[name]
+    return g.lengths[g.names.index(name)]
+
+def mafBlock(g, topName, topLength, beg, size, botPlace, mismap, seqLength):
+    botName, botBeg, strand = botPlace
+    botSeqLength = botLength(g, botName)
+    if strand == "-": botBeg = botSeqLength - botBeg - size
+    text = ("ACGTTGCA" * (min(size, seqLength) // 8 + 1))[:min(size, seqLength)]
+    return ("a score=%d mismap=%s\n"
+            "s top.%s %d %d + %d %s\n"
+            "s bot.%s %d %d %s %d %s\n\n" %
+            (size, mismap, topName, beg, size, topLength, text,
+             botName, botBeg, size, strand, botSeqLength, text))
+
+def writeMaf(r, g, out, seqLength):
+    out.write("##maf version=1 scoring=synthetic\n\n")
+    botLengths = dict(zip(g.names, g.lengths))
+    for c, name in enumerate(g.names):
+        begs = g.begs[c]
+        sizes = g.sizes[c]
+        for i in range(len(begs)):
+            botPlace = g.botPlaces.get((c, i), (name, begs[i], "+"))
+            mismap = "1e-%d" % randInt(r, 6, 10)
+            out.write(mafBlock(g, name, g.lengths[c], begs[i], sizes[i],
+                               botPlace, mismap, seqLength))
+    for name, length, segments in g.fragments:
+        for k, (beg, size) in enumerate(segments):
+            out.write(mafBlock(g, name, length, beg, size,
+                               g.botPlaces[name, k], "1e-10", seqLength))
+
+def writeGaps(gaps, out):
+    for ix, (name, beg, end) in enumerate(sorted(gaps)):
+        out.write("0\t%s\t%d\t%d\t%d\tN\t%d\tcontig\tno\n" %
+                  (name, beg, end, ix + 1, end - beg))
+
+def writeReference(r, g, out):
+    # The shared events' top edges, with edges in another genome, "oth".
+    # Each event's edges are moved by the same amount, so they stay in
+    # the same order (supported-rearrangements.py won't pair crossed edges)
+    for eventType, isShared, edges in g.events:
+        if not isShared: continue
+        shift = randInt(r, -50, 50)
+        fields = []
+        for e in edges:
+            head, tail = e.split(":")
+            coordinate = int(tail[:-1]) + shift
+            fields.append("%s:%d%s" % (head, coordinate, tail[-1]))
+            fields.append("oth.chr%d:%d%s" % (randInt(r, 1, 20),
+                                              randInt(r, 0, 10 ** 8), tail[-1]))
+        out.write(" ".join(fields) + "\n")
+
+def pslLine(name, exonSizes, chrom, tBeg, strand):
+    qStarts = []
+    tStarts = []
+    q = 0
+    t = tBeg
+    for size in exonSizes:
+        qStarts.append(q)
+        tStarts.append(t)
+        q += size
+        t += size + 1000  # an intron
+    fields = [q, 0, 0, 0, 0, 0, len(exonSizes) - 1, t - tBeg - q, strand,
+              name, q, 0, q, chrom, 10 ** 9, tBeg, t - 1000, len(exonSizes),
+              ",".join(map(str, exonSizes)) + ",",
+              ",".join(map(str, qStarts)) + ",",
+              ",".join(map(str, tStarts)) + ","]
+    return "\t".join(map(str, fields)) + "\n"
+
+def lastLine(name, rnaBeg, rnaSize, rnaLength, chrom, beg, size, blocks):
+    return "%d\t%s\t%d\t%d\t+\t%d\t%s\t%d\t%d\t+\t%d\t%s\n" % (
+        rnaSize, name, rnaBeg, rnaSize, rnaLength, chrom, beg, size, 10 ** 9,
+        blocks)
+
+def writeGenes(r, g, pslOut, lastOut, numOfGenes):
+    lastOut.write("# LAST tabular, synthetic\n")
+    for k, (chrom, beg, end) in enumerate(g.retros):
+        # a 2-exon RNA, whose whole length matches the retro insertion
+        name = "NM_retro%d" % k
+        size = end - beg
+        first = randInt(r, 60, size - 60)
+        pslOut.write(pslLine(name, [first, size - first], "chr1", 0, "+"))
+        lastOut.write(lastLine(name, 0, size, size, chrom, beg, size,
+                               str(size)))
+    for k in range(numOfGenes):
+        name = "NM_%d" % k
+        exonSizes = [randInt(r, 60, 400) for i in range(randInt(r, 1, 5))]
+        length = sum(exonSizes)
+        strand = "+" if r.random() < 0.8 else "-"
+        pslOut.write(pslLine(name, exonSizes, "chr1", randInt(r, 0, 10 ** 8),
+                             strand))
+        # alignments of it, on a chromosome that isn't in the MAF, some
+        # of which are spliced retrosequences
+        for a in range(randInt(r, 0, 3)):
+            rnaBeg = randInt(r, 0, length - 20)
+            rnaSize = randInt(r, 20, length - rnaBeg)
+            rnaLength = length if r.random() < 0.95 else length + 1
+            blocks = randItem(r, ["%d" % rnaSize, "%d,0:5,10" % rnaSize,
+                                  "%d,0:50,10" % rnaSize])
+            lastOut.write(lastLine(name, rnaBeg, rnaSize, rnaLength, "chrR",
+                                   randInt(r, 0, 10 ** 8), rnaSize, blocks))
+        if r.random() < 0.2:  # an RNA that isn't in the PSL
+            lastOut.write(lastLine("XM_%d" % k, 0, 100, 100, "chrR",
+                                   randInt(r, 0, 10 ** 8), 100, "100"))
+
+def writePlanted(g, out):
+    out.write("#type\tshared\ttopEdges\n")
+    for eventType, isShared, edges in g.events:
+        out.write("%s\t%d\t%s\n" % (eventType, isShared, " ".join(edges)))
+
+def makeSyntheticData(opts, args):
+    prefix = args[0]
+    r = random.Random(opts.seed)
+    g = Genomes()
+    numOfSegments = max(opts.alignments // opts.chromosomes, 10)
+    for c in range(opts.chromosomes):
+        layOutChromosome(r, g, "chr%d" % (c + 1), numOfSegments, 0.02)
+    plantEvents(r, g, max(opts.alignments // opts.event_spacing, 1))
+    addRandomGaps(r, g, 0.05)
+    writeMaf(r, g, open(prefix + ".maf", "w"), opts.seq_length)
+    writeGaps(g.gaps1, open(prefix + ".gap1", "w"))
+    writeGaps(g.gaps2, open(prefix + ".gap2", "w"))
+    writeReference(r, g, open(prefix + ".ref", "w"))
+    writeGenes(r, g, open(prefix + ".psl", "w"), open(prefix + ".tab", "w"),
+               max(opts.alignments // 20, 10))
+    writePlanted(g, open(prefix + ".planted", "w"))
+
+if __name__ == "__main__":
+    usage = "%prog [options] output-prefix"
+    description = "Make synthetic genome alignments with planted rearrangements, and matching inputs for the other scripts."
+    op = optparse.OptionParser(usage=usage, description=description)
+    op.add_option("-n", "--alignments", metavar="N", type="int", default=1000,
+                  help="about this many alignments (default: %default)")
+    op.add_option("-c", "--chromosomes", metavar="N", type="int", default=10,
+                  help="number of chromosomes (default: %default)")
+    op.add_option("-e", "--event-spacing", metavar="N", type="int",
+                  default=100, help="try to plant one event per N "
+                  "alignments (default: %default)")
+    op.add_option("-l", "--seq-length", metavar="N", type="int", default=50,
+                  help="write at most N bases of each aligned sequence, "
+                  "which the parser skips anyway (default: %default)")
+    op.add_option("-s", "--seed", metavar="N", type="int", default=1,
+                  help="random seed (default: %default)")
+    opts, args = op.parse_args()
+    if len(args) != 1: op.error("I need 1 output prefix")
+    makeSyntheticData(opts, args)
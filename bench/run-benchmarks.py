@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+# Copyright 2016 Martin C. Frith
+
+# Run each script on synthetic data (from make-synthetic-data.py) of
+# several sizes, and write a table of run time, throughput, peak
+# memory, and scaling: the exponent x in time ~ size^x, from the
+# previous size.
+
+from __future__ import print_function
+
+import json, math, optparse, os, shutil, subprocess, sys, tempfile, time
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+scriptDir = os.path.dirname(benchDir)
+
+def scriptArgs(d, outDir):
+    # (script, arguments, stats option, what it counts, how to count it)
+    detected = os.path.join(outDir, "detect.txt")
+    retros = os.path.join(outDir, "retros.tab")
+    return [
+        ("genome-rearrangements.py",
+         ["-1", d + ".gap1", "-2", d + ".gap2", d + ".maf"], "-s",
+         "alignments", lambda c: c["alignmentsRead"], detected),
+        ("supported-rearrangements.py", [d + ".ref", detected], "-s",
+         "edges", lambda c: c["queryEdges"] + c["referenceEdges"], None),
+        ("last-spliced-retroseqs.py", [d + ".psl", d + ".tab"], "-s",
+         "alignments", lambda c: c["alignments"], retros),
+        ("rearrangement-retrofilter.py", ["-g", "top", retros, detected],
+         "--stats", "rearrangements", lambda c: c["rearrangements"], None),
+    ]
+
+def runOnce(script, args, statsOption, outFileName, tmpDir):
+    statsFileName = os.path.join(tmpDir, "stats.json")
+    command = [sys.executable, os.path.join(scriptDir, script),
+               statsOption, statsFileName] + args
+    out = open(outFileName or os.devnull, "w")
+    beg = time.time()
+    subprocess.check_call(command, stdout=out)
+    seconds = time.time() - beg
+    out.close()
+    return seconds, json.load(open(statsFileName))
+
+def scalingExponent(oldRow, size, seconds):
+    if not oldRow or oldRow[1] == size or min(oldRow[3], seconds) <= 0:
+        return "-"
+    x = math.log(seconds / oldRow[3]) / math.log(float(size) / oldRow[1])
+    return "%.2f" % x
+
+def runBenchmarks(opts, args):
+    tmpDir = tempfile.mkdtemp()
+    dataDir = opts.data_dir or tmpDir
+    if not os.path.isdir(dataDir): os.makedirs(dataDir)
+    generator = os.path.join(benchDir, "make-synthetic-data.py")
+    results = []
+    oldRows = {}
+    print("#script", "size", "items", "wallSeconds", "itemsPerSecond",
+          "peakRssKb", "scaling", sep="\t")
+    try:
+        for size in map(int, opts.sizes.split(",")):
+            d = os.path.join(dataDir, "syn%d" % size)
+            if not os.path.exists(d + ".planted"):
+                subprocess.check_call([sys.executable, generator,
+                                       "-n", str(size), d])
+            for s in scriptArgs(d, tmpDir):
+                script, scriptArgList, statsOption, itemName, itemCount, out = s
+                runs = [runOnce(script, scriptArgList, statsOption, out, tmpDir)
+                        for i in range(opts.repeats)]
+                seconds, stats = min(runs, key=lambda i: i[0])
+                items = itemCount(stats["counts"])
+                peak = max(i["peakRssKb"] for i in stats["stages"])
+                exponent = scalingExponent(oldRows.get(script), size, seconds)
+                row = [script, size, items, seconds,
+                       items / max(seconds, 1e-6), peak, exponent]
+                print(script, size, "%d %s" % (items, itemName),
+                      "%.3f" % seconds, "%.0f" % row[4], peak, exponent,
+                      sep="\t")
+                sys.stdout.flush()
+                oldRows[script] = row
+                results.append(dict(script=script, size=size, items=items,
+                                    itemName=itemName, wallSeconds=seconds,
+                                    peakRssKb=peak, stats=stats))
+    finally:
+        shutil.rmtree(tmpDir)
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+            f.write("\n")
+
+if __name__ == "__main__":
+    usage = "%prog [options]"
+    description = "Time the scripts on synthetic data of several sizes."
+    op = optparse.OptionParser(usage=usage, description=description)
+    op.add_option("-n", "--sizes", metavar="N,N,...",
+                  default="1000,10000,100000", help="numbers of alignments "
+                  "(up to 10000000) (default: %default)")
+    op.add_option("-r", "--repeats", metavar="N", type="int", default=1,
+                  help="report the fastest of N runs (default: %default)")
+    op.add_option("-d", "--data-dir", metavar="DIR",
+                  help="keep the synthetic data in DIR, and reuse it")
+    op.add_option("--json", metavar="FILE",
+                  help="also write all the results, with each run's stats, "
+                  "to FILE")
+    opts, args = op.parse_args()
+    if args: op.error("I don't take any file names")
+    runBenchmarks(opts, args)
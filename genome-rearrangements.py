@@ -7,11 +7,25 @@
 
 from __future__ import print_function
 
-import bisect, operator, optparse, signal, sys, warnings
+import array, bisect, collections, heapq, itertools, mmap
+import multiprocessing, optparse, os, re, resource, signal, struct, sys
+import tempfile, time, warnings
 
-def myOpen(fileName):  # faster than fileinput
-    if fileName == '-': return sys.stdin
-    else:               return open(fileName)
+import rearrangementutils as U
+
+# Run statistics, written as JSON by the --stats option
+counts = U.counts
+stage = U.stage
+chainLengthCounts = collections.Counter()
+progressSeconds = None  # if set, show progress at most this often
+progressTime = [0.0]
+
+def showProgress(message):
+    if progressSeconds is None: return
+    now = time.time()
+    if now - progressTime[0] < progressSeconds: return
+    progressTime[0] = now
+    sys.stderr.write(os.path.basename(sys.argv[0]) + ": " + message + "\n")
 
 def chromosomeNameOnly(chromosomeName):  # remove genome name, if any
     return chromosomeName.split(".")[-1]
@@ -48,59 +62,472 @@ def readGaps(lines):
             isOrderedGap = False
         yield seqName, beg, end, isOrderedGap
 
+# A gap index maps each sequence name to the gaps in that sequence,
+# sorted by start coordinate.  They are stored in columns: starts,
+# ends, and whether each gap is ordered.
+def gapIndex(sortedGaps):
+    index = {}
+    for seqName, beg, end, isOrderedGap in sortedGaps:
+        if seqName not in index:
+            index[seqName] = array.array("l"), array.array("l"), bytearray()
+        begs, ends, isOrderedGaps = index[seqName]
+        begs.append(beg)
+        ends.append(end)
+        isOrderedGaps.append(isOrderedGap)
+    return index
+
 def getGaps(fileName):
-    if fileName: gaps = list(readGaps(myOpen(fileName)))
+    if fileName: gaps = list(readGaps(U.myOpen(fileName)))
     else:        gaps = []
     gaps.sort()
     unorderedGaps = [i for i in gaps if not i[3]]
-    return gaps, unorderedGaps
+    return gapIndex(gaps), gapIndex(unorderedGaps)
 
 def gapLength(gap):
     return gap[2] - gap[1]
 
-def isReliableMaf(aLine, maxMismap):
-    for i in aLine.split():
-        x = i.split("=")
-        if len(x) > 1 and x[0] == "mismap":
-            return float(x[1]) <= maxMismap
-    return True
+# The edges are stored in parallel columns, indexed by serial number.
+# Alignment k has 4 edges (2 ends x 2 sequences): 4k is its start in
+# genome 1, 4k+1 is the aligned edge in genome 2, 4k+2 is its end in
+# genome 1, and 4k+3 is the aligned edge in genome 2.  So edge i is in
+# genome (i & 1) + 1, and is aligned to edge i ^ 1.
+class EdgeTable(object):
+    def __init__(self):
+        self.seqNames = []                # interned sequence names
+        self.seqIds = array.array("i")    # index into seqNames
+        self.coords = array.array("l")    # 64-bit on LP64 platforms
+        self.isStarts = bytearray()       # 1 for a start, 0 for an end
+        self.facing = array.array("i")    # serial number of facing edge
+        self.mismaps = array.array("d")   # one per alignment, not per edge
+
+    def __len__(self):
+        return len(self.coords)
+
+def edgeGenome(i):
+    return (i & 1) + 1
+
+def edgeAligned(i):
+    return i ^ 1
 
-# This reads pair-wise local alignments, and returns 4 edges per
-# alignment (2 ends x 2 sequences).  Each edge has these fields:
+# This returns one edge as a list, with these fields:
 # 0 serial number
 # 1 genome number
 # 2 sequence name
 # 3 coordinate
 # 4 whether it's a start or an end
 # 5 serial number of the edge that is aligned to this one
-def alignmentEdgesFromMaf(lines, maxMismap):
-    i = 0  # serial number for alignment ends
-    for line in lines:
-        if line[0] == "a":
+# 6 serial number of the edge that faces this one, or -1
+def edgeAt(table, i):
+    if table.isStarts[i]: edgeType = "start"
+    else:                 edgeType = "end"
+    return [i, edgeGenome(i), table.seqNames[table.seqIds[i]],
+            table.coords[i], edgeType, edgeAligned(i), table.facing[i]]
+
+# MAF "s" line fields, up to but not including the aligned sequence
+mafSequenceLinePattern = re.compile(
+    br"s[ \t]+(\S+)[ \t]+(\d+)[ \t]+(\d+)[ \t]+([+-])[ \t]+(\d+)")
+
+mafMismapPattern = re.compile(br"\smismap=(\S+)")
+
+# What indexing a byte buffer gives: an int in python3, a str in python2
+mafAlignmentLineType = b"a"[0]
+mafSequenceLineType = b"s"[0]
+
+def textFromBytes(b):
+    if str is bytes: return b
+    return b.decode()
+
+def mafChunks(lines, chunkSize=1<<24):
+    # Yield chunks of whole MAF blocks, i.e. each one starts at an "a"
+    # line.
+    tail = b""
+    while 1:
+        data = lines.read(chunkSize)
+        if not data: break
+        buf = tail + data
+        cut = buf.rfind(b"\na") + 1
+        if cut > 0:
+            yield buf[:cut]
+            tail = buf[cut:]
+        else:
+            tail = buf
+    if tail: yield tail
+
+def mafShardRanges(buf, numOfShards):
+    # Split the buffer into byte ranges that start at "a" lines
+    size = len(buf)
+    cuts = [0]
+    for k in range(1, numOfShards):
+        cut = buf.find(b"\na", max(size * k // numOfShards, cuts[-1])) + 1
+        if cut > 0: cuts.append(cut)
+    cuts.append(size)
+    return [(cuts[i], cuts[i+1]) for i in range(len(cuts) - 1)]
+
+# This reads pair-wise local alignments from a buffer, and appends 4
+# edges per alignment to the table (and, optionally, the byte offset of
+# its "a" line to offsets).  It never splits the aligned sequences: it
+# splits just the start of each "s" line, and after the second one, it
+# skips to the next "a" line.
+def addMafEdges(table, seqIdDict, buf, maxMismap, pos=0, bufEnd=None,
+                offsets=None):
+    seqIds = table.seqIds
+    coords = table.coords
+    isStarts = table.isStarts
+    mismaps = table.mismaps
+    sequenceLineMatch = mafSequenceLinePattern.match
+    mismapSearch = mafMismapPattern.search
+    find = buf.find
+    if bufEnd is None: bufEnd = len(buf)
+    isWanted = False
+    numOfAlignments = numOfRejects = 0
+    while pos < bufEnd:
+        lineEnd = find(b"\n", pos, bufEnd)
+        if lineEnd < 0: lineEnd = bufEnd
+        lineType = buf[pos]
+        if lineType == mafAlignmentLineType:
             genomeNumber = 0
-            isWanted = isReliableMaf(line, maxMismap)
-        if line[0] == "s" and isWanted:
+            blockPos = pos
+            m = mismapSearch(buf, pos, lineEnd)
+            mismap = float(m.group(1)) if m else 0.0
+            isWanted = mismap <= maxMismap
+            numOfAlignments += 1
+            if not isWanted: numOfRejects += 1
+        elif lineType == mafSequenceLineType and isWanted:
             genomeNumber += 1
-            s, seqName, beg, span, strand, seqLen, aln = line.split(None, 6)
-            if strand == "+":
+            fields = buf[pos:min(lineEnd, pos + 128)].split(None, 6)
+            if len(fields) == 7:  # the numbers end before the slice does
+                seqName, beg, span, strand, seqLen = fields[1:6]
+            else:  # e.g. a very long name
+                m = sequenceLineMatch(buf, pos, lineEnd)
+                seqName, beg, span, strand, seqLen = m.groups()
+            if strand == b"+":
                 beg = int(beg)
                 end = beg + int(span)
-                begType = "start"
-                endType = "end"
+                isPlus = 1
             else:
                 beg = int(seqLen) - int(beg)
                 end = beg - int(span)
-                begType = "end"
-                endType = "start"
+                isPlus = 0
+            seqId = seqIdDict.get(seqName)
+            if seqId is None:
+                seqId = seqIdDict[seqName] = len(table.seqNames)
+                table.seqNames.append(textFromBytes(seqName))
             if genomeNumber == 1:
-                yield [i+0, 1, seqName, beg, begType, i+1]
-                yield [i+2, 1, seqName, end, endType, i+3]
+                seqId1, beg1, end1, isPlus1 = seqId, beg, end, isPlus
             if genomeNumber == 2:
-                yield [i+1, 2, seqName, beg, begType, i+0]
-                yield [i+3, 2, seqName, end, endType, i+2]
-                i += 4
+                seqIds.extend((seqId1, seqId, seqId1, seqId))
+                coords.extend((beg1, beg, end1, end))
+                isStarts.extend((isPlus1, isPlus, 1 - isPlus1, 1 - isPlus))
+                mismaps.append(mismap)
+                if offsets is not None: offsets.append(blockPos)
+                # Skip the rest of the block: usually just a blank line
+                lineEnd = find(b"\na", lineEnd, bufEnd)
+                if lineEnd < 0: lineEnd = bufEnd
+        pos = lineEnd + 1
+    return numOfAlignments, numOfRejects
 
-def gapsBetween(edgeA, edgeB, bothGenomeGaps):
+def edgeTableFromMafShard(args):  # runs in a worker process
+    fileName, beg, end, maxMismap = args
+    table = EdgeTable()
+    n = addMafEdges(table, {}, U.mmapOrNone(fileName), maxMismap, beg, end)
+    return (table.seqNames, table.seqIds, table.coords, table.isStarts,
+            table.mismaps), n
+
+def mergeEdgeTableShards(table, shards):
+    seqIdDict = {}
+    for seqNames, seqIds, coords, isStarts, mismaps in shards:
+        newIds = []
+        for seqName in seqNames:
+            if seqName not in seqIdDict:
+                seqIdDict[seqName] = len(table.seqNames)
+                table.seqNames.append(seqName)
+            newIds.append(seqIdDict[seqName])
+        table.seqIds.extend(newIds[i] for i in seqIds)
+        table.coords.extend(coords)
+        table.isStarts.extend(isStarts)
+        table.mismaps.extend(mismaps)
+
+def diskColumn(f, typecode):
+    f.flush()
+    if os.fstat(f.fileno()).st_size == 0: return array.array(typecode)
+    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return U.mappedColumn(buf, typecode)
+
+def writableDiskColumn(typecode, length, value):
+    f = tempfile.TemporaryFile()
+    block = array.array(typecode, [value]) * 65536
+    for i in range(0, length, len(block)):
+        f.write(U.columnBytes(block[:length - i]))
+    f.flush()
+    if not length: return array.array(typecode)
+    buf = mmap.mmap(f.fileno(), 0)
+    return U.mappedColumn(buf, typecode)
+
+def edgeTableColumns(table):
+    return [(table.seqIds, "i"), (table.coords, "l"), (table.isStarts, "B"),
+            (table.mismaps, "d")]
+
+def spillEdgeTable(table, files):
+    for (column, typecode), f in zip(edgeTableColumns(table), files):
+        f.write(U.columnBytes(column))
+        del column[:]
+
+def mafSlices(fileName, buf):
+    # Yield (buffer, beg, end) for pieces of the MAF of about 16 MB
+    if buf is None:
+        for chunk in mafChunks(U.myOpenBytes(fileName)):
+            yield chunk, 0, len(chunk)
+    else:
+        for beg, end in mafShardRanges(buf, len(buf) // (1 << 24) + 1):
+            yield buf, beg, end
+
+def addMafSliceEdges(table, seqIdDict, fileName, buf, maxMismap):
+    # Parse the MAF one slice at a time, and yield after each slice
+    numOfAlignments = numOfRejects = 0
+    numOfBytes = 0
+    for chunk, beg, end in mafSlices(fileName, buf):
+        a, r = addMafEdges(table, seqIdDict, chunk, maxMismap, beg, end)
+        numOfAlignments += a
+        numOfRejects += r
+        numOfBytes += end - beg
+        showProgress("read %d MB, %d alignments" %
+                     (numOfBytes >> 20, numOfAlignments))
+        yield
+    counts["alignmentsRead"] += numOfAlignments
+    counts["alignmentsRejectedByMismap"] += numOfRejects
+
+def edgeTableFromMafWithMaxMemory(fileName, maxMismap, maxMemory):
+    # Parse the MAF in slices: if the edge table gets too big, move it
+    # to temporary files, which are memory-mapped at the end
+    table = EdgeTable()
+    buf = U.mmapOrNone(fileName)
+    files = None
+    for i in addMafSliceEdges(table, {}, fileName, buf, maxMismap):
+        if files or len(table) * inMemoryBytesPerEdge > maxMemory:
+            if not files:
+                files = [tempfile.TemporaryFile() for i in range(4)]
+            spillEdgeTable(table, files)
+    if files:
+        spillEdgeTable(table, files)
+        table.seqIds, table.coords, table.isStarts, table.mismaps = \
+            [diskColumn(f, typecode) for (column, typecode), f
+             in zip(edgeTableColumns(table), files)]
+    return table
+
+def edgeTableFromMaf(fileName, maxMismap, numOfJobs=1):
+    table = EdgeTable()
+    buf = U.mmapOrNone(fileName)
+    if buf is not None and numOfJobs > 1:
+        ranges = mafShardRanges(buf, numOfJobs)
+        jobs = [(fileName, beg, end, maxMismap) for beg, end in ranges]
+        pool = multiprocessing.Pool(numOfJobs)
+        results = pool.map(edgeTableFromMafShard, jobs)
+        pool.close()
+        pool.join()
+        mergeEdgeTableShards(table, [shard for shard, n in results])
+        counts["alignmentsRead"] += sum(n[0] for shard, n in results)
+        counts["alignmentsRejectedByMismap"] += sum(n[1] for shard, n in
+                                                    results)
+    else:
+        for i in addMafSliceEdges(table, {}, fileName, buf, maxMismap):
+            pass
+    return table
+
+def wantedAlignments(table, maxMismap):
+    return [k for k, m in enumerate(table.mismaps) if m <= maxMismap]
+
+def edgeTableWithMaxMismap(table, maxMismap):
+    return edgeSubtable(table, wantedAlignments(table, maxMismap))
+
+def edgeSubtable(table, wanted):  # wanted alignment numbers, in order
+    if len(wanted) == len(table.mismaps): return table
+    newTable = EdgeTable()
+    newTable.seqNames = table.seqNames
+    runBeg = 0
+    for i in range(1, len(wanted) + 1):  # copy runs of consecutive alignments
+        if i < len(wanted) and wanted[i] == wanted[i - 1] + 1: continue
+        beg = wanted[runBeg]
+        end = wanted[i - 1] + 1
+        U.extendColumn(newTable.seqIds, table.seqIds, beg * 4, end * 4)
+        U.extendColumn(newTable.coords, table.coords, beg * 4, end * 4)
+        U.extendColumn(newTable.isStarts, table.isStarts, beg * 4, end * 4)
+        U.extendColumn(newTable.mismaps, table.mismaps, beg, end)
+        runBeg = i
+    return newTable
+
+# The cache holds parsed inputs in a binary file per input file: a
+# JSON header line, then raw columns, which are memory-mapped when
+# read back.  The header records the input's path, size, modification
+# time, and a hash of sampled blocks, so a stale cache is detected
+# without reading the whole input.
+cacheMagic = b"genome-rearrangements cache 1\n"
+
+def cachedEdgeTable(cacheDir, fileName, numOfJobs):
+    if not U.isRegularFile(fileName):
+        return edgeTableFromMaf(fileName, float("inf"), numOfJobs)
+    path = U.cachePath(cacheDir, fileName, "maf.cache")
+    signature = U.inputSignature(fileName)
+    cached = U.readCache(path, cacheMagic, signature)
+    if cached:
+        header, columns = cached
+        table = EdgeTable()
+        table.seqNames = [str(i) for i in header["seqNames"]]
+        table.seqIds = columns["seqIds"]
+        table.coords = columns["coords"]
+        table.isStarts = columns["isStarts"]
+        table.mismaps = columns["mismaps"]
+        return table
+    table = edgeTableFromMaf(fileName, float("inf"), numOfJobs)
+    header = dict(signature, seqNames=table.seqNames)
+    columns = [("seqIds", "i", table.seqIds), ("coords", "l", table.coords),
+               ("isStarts", "B", table.isStarts),
+               ("mismaps", "d", table.mismaps)]
+    U.writeCache(path, cacheMagic, header, columns)
+    return table
+
+def gapIndexColumns(index, prefix):
+    seqNames = sorted(index)
+    columns = [(prefix + "Begs", "l", array.array("l")),
+               (prefix + "Ends", "l", array.array("l")),
+               (prefix + "IsOrdered", "B", bytearray())]
+    for seqName in seqNames:
+        for (name, typecode, column), x in zip(columns, index[seqName]):
+            column.extend(x)
+    counts = [len(index[i][0]) for i in seqNames]
+    return seqNames, counts, columns
+
+def gapIndexFromColumns(seqNames, counts, columns):
+    index = {}
+    beg = 0
+    for seqName, count in zip(seqNames, counts):
+        end = beg + count
+        index[str(seqName)] = tuple(i[beg:end] for i in columns)
+        beg = end
+    return index
+
+def cachedGaps(cacheDir, fileName):
+    if not fileName or not U.isRegularFile(fileName): return getGaps(fileName)
+    path = U.cachePath(cacheDir, fileName, "gap.cache")
+    signature = U.inputSignature(fileName)
+    cached = U.readCache(path, cacheMagic, signature)
+    if cached:
+        header, columns = cached
+        return [gapIndexFromColumns(header[p + "SeqNames"],
+                                    header[p + "Counts"],
+                                    [columns[p + i] for i in
+                                     ("Begs", "Ends", "IsOrdered")])
+                for p in ("all", "unordered")]
+    indexes = getGaps(fileName)
+    header = dict(signature)
+    columns = []
+    for p, index in zip(("all", "unordered"), indexes):
+        seqNames, counts, c = gapIndexColumns(index, p)
+        header[p + "SeqNames"] = seqNames
+        header[p + "Counts"] = counts
+        columns += c
+    U.writeCache(path, cacheMagic, header, columns)
+    return indexes
+
+# A MAF index has the edge table of all alignments, the byte offset of
+# each alignment's "a" line, and the edges in facingSortOrder, with
+# their coordinates and their ranks in that order.  So the edges in a
+# region, and the edges they face, are found by bisection, and only
+# the blocks of those alignments need to be read.  It's stored like a
+# cache file.
+def mafIndexPath(cacheDir, fileName):
+    if cacheDir: return U.cachePath(cacheDir, fileName, "maf.index")
+    return fileName + ".index"
+
+def seqRangesInOrder(table, order):
+    # [genome, sequence name, beg, end] of each sequence's edges in order
+    key = lambda k: (edgeGenome(order[k]), table.seqIds[order[k]])
+    ranges = []
+    for (genome, seqId), g in itertools.groupby(range(len(order)), key):
+        beg = next(g)
+        end = beg + 1 + sum(1 for i in g)
+        ranges.append([genome, table.seqNames[seqId], beg, end])
+    return ranges
+
+def writeMafIndex(path, fileName):
+    buf = U.mmapOrNone(fileName)
+    if buf is None: raise Exception("can't index this MAF file: " + fileName)
+    table = EdgeTable()
+    offsets = array.array("l")
+    addMafEdges(table, {}, buf, float("inf"), 0, len(buf), offsets)
+    order = array.array("i", facingSortOrder(table))
+    ranks = array.array("i", [0]) * len(order)
+    for k, i in enumerate(order):
+        ranks[i] = k
+    orderCoords = array.array("l", [table.coords[i] for i in order])
+    header = dict(U.inputSignature(fileName), seqNames=table.seqNames,
+                  seqRanges=seqRangesInOrder(table, order))
+    columns = [("seqIds", "i", table.seqIds), ("coords", "l", table.coords),
+               ("isStarts", "B", table.isStarts),
+               ("mismaps", "d", table.mismaps), ("offsets", "l", offsets),
+               ("order", "i", order), ("ranks", "i", ranks),
+               ("orderCoords", "l", orderCoords)]
+    U.writeCache(path, cacheMagic, header, columns)
+
+def mafIndex(cacheDir, fileName):
+    # Read the index, after making it if it's absent or stale
+    path = mafIndexPath(cacheDir, fileName)
+    signature = U.inputSignature(fileName)
+    cached = U.readCache(path, cacheMagic, signature)
+    if not cached:
+        writeMafIndex(path, fileName)
+        cached = U.readCache(path, cacheMagic, signature)
+    return cached
+
+def gapRangeInIndex(gaps, seqName, beg, end):
+    # find the gaps that start in [beg, end)
+    seqGaps = gaps.get(seqName)
+    if not seqGaps: return seqGaps, 0, 0
+    begs, ends, isOrderedGaps = seqGaps
+    lo = bisect.bisect_left(begs, beg)
+    hi = bisect.bisect_left(begs, end, lo)
+    for i in range(lo, hi):
+        if ends[i] > end:
+            warnings.warn("a gap overlaps an alignment")
+    return seqGaps, lo, hi
+
+def gapsInRange(gaps, seqName, beg, end):
+    seqGaps, lo, hi = gapRangeInIndex(gaps, seqName, beg, end)
+    counts["gapQueries"] += 1
+    counts["gapsScanned"] += hi - lo
+    if lo == hi: return []
+    begs, ends, isOrderedGaps = seqGaps
+    return [(seqName, begs[i], ends[i], bool(isOrderedGaps[i]))
+            for i in range(lo, hi)]
+
+def isGapInRange(gaps, seqName, beg, end):
+    seqGaps, lo, hi = gapRangeInIndex(gaps, seqName, beg, end)
+    counts["gapQueries"] += 1
+    counts["gapsScanned"] += hi - lo
+    return lo < hi
+
+def isGapFreeRanges(seqGaps, ranges):
+    # Check many ranges in one sweep: the ranges must be sorted and
+    # non-overlapping.  This yields True for each range with no gaps.
+    if not seqGaps:
+        for beg, end in ranges:
+            counts["gapQueries"] += 1
+            yield True
+        return
+    begs, ends, isOrderedGaps = seqGaps
+    numOfGaps = len(begs)
+    i = 0
+    for beg, end in ranges:
+        while i < numOfGaps and begs[i] < beg: i += 1
+        j = i
+        while j < numOfGaps and begs[j] < end:
+            if ends[j] > end:
+                warnings.warn("a gap overlaps an alignment")
+            j += 1
+        counts["gapQueries"] += 1
+        counts["gapsScanned"] += j - i
+        yield j == i
+
+def genomeGapsAndRange(edgeA, edgeB, bothGenomeGaps):
     genome1gaps, genome2gaps = bothGenomeGaps
     assert edgeA[1:3] == edgeB[1:3]  # same genome and sequence
     if edgeA[1] == 1: gaps = genome1gaps
@@ -110,41 +537,140 @@ def gapsBetween(edgeA, edgeB, bothGenomeGaps):
     coordinateB = edgeB[3]
     beg = min(coordinateA, coordinateB)
     end = max(coordinateA, coordinateB)
-    fakeBegGap = seqName, beg, beg, False
-    fakeEndGap = seqName, end, end, False
-    i = bisect.bisect(gaps, fakeBegGap)
-    gapList = []
-    while i < len(gaps) and gaps[i] < fakeEndGap:
-        if gaps[i][2] > end:
-            warnings.warn("a gap overlaps an alignment")
-        gapList.append(gaps[i])
-        i += 1
-    return gapList
-
-def isFacing(edgeA, edgeB, maxDistance, unorderedGaps):
-    if edgeA[1:3] != edgeB[1:3]: return False
-    assert edgeA[3] <= edgeB[3]
-    if edgeB[3] - edgeA[3] > maxDistance: return False
-    if gapsBetween(edgeA, edgeB, unorderedGaps): return False
-    return True
+    return gaps, seqName, beg, end
+
+def gapsBetween(edgeA, edgeB, bothGenomeGaps):
+    return gapsInRange(*genomeGapsAndRange(edgeA, edgeB, bothGenomeGaps))
+
+def isGapBetween(edgeA, edgeB, bothGenomeGaps):
+    return isGapInRange(*genomeGapsAndRange(edgeA, edgeB, bothGenomeGaps))
+
+def isNearby(table, i, j, maxDistance):
+    if (i ^ j) & 1: return False  # different genomes
+    if table.seqIds[i] != table.seqIds[j]: return False
+    assert table.coords[i] <= table.coords[j]
+    return table.coords[j] - table.coords[i] <= maxDistance
+
+# Rough peak memory use per edge, when finding facing edges in memory:
+# mostly the sort in facingSortOrder
+inMemoryBytesPerEdge = 110
+
+def sequenceRanks(table):
+    seqRanks = [0] * len(table.seqNames)
+    for rank, seqId in enumerate(sorted(range(len(table.seqNames)),
+                                        key=table.seqNames.__getitem__)):
+        seqRanks[seqId] = rank
+    return seqRanks
+
+def facingSortOrder(table):
+    # sort by genome, sequence name, coordinate, and end before start
+    seqRanks = sequenceRanks(table)
+    seqIds = table.seqIds
+    coords = table.coords
+    isStarts = table.isStarts
+    numOfSeqs = len(seqRanks)
+    coordLimit = max(coords) + 1 if coords else 1
+    def packedKey(i):
+        r = (i & 1) * numOfSeqs + seqRanks[seqIds[i]]
+        return (r * coordLimit + coords[i]) * 2 + isStarts[i]
+    return sorted(range(len(table)), key=packedKey)
 
-def appendFacingSerialNumbers(edges, maxDistance, unorderedGaps):
-    edges.sort(key=operator.itemgetter(1, 2, 3, 4))
-    for i, x in enumerate(edges):
-        facing = -1
-        if i % 2:
-            assert x[4] == "end"
-            if i+1 < len(edges):
-                y = edges[i+1]
-                if isFacing(x, y, maxDistance, unorderedGaps):
-                    facing = y[0]
+# Big-endian, so that the packed records sort in the same order as
+# facingSortOrder.  The last field is the serial number, which makes
+# ties sort the same way too.
+edgeSortRecord = struct.Struct(">BIQBI")
+
+def edgeSortRecordsFromRun(f):
+    size = edgeSortRecord.size
+    f.seek(0)
+    while 1:
+        data = f.read(size * 65536)
+        if not data: break
+        for i in range(0, len(data), size):
+            yield data[i:i+size]
+
+def maxOpenRunsForLimit():
+    # How many sorted runs to keep open, leaving file descriptors spare
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if limit == resource.RLIM_INFINITY: return 256
+    return max(2, min(256, (limit - 16) // 2))
+
+def mergedEdgeSortRun(runs):
+    f = tempfile.TemporaryFile()
+    merged = heapq.merge(*[edgeSortRecordsFromRun(i) for i in runs])
+    while 1:
+        records = list(itertools.islice(merged, 65536))
+        if not records: break
+        f.write(b"".join(records))
+    for i in runs: i.close()
+    return f
+
+def externalSortOrder(table, maxInMemory, maxOpenRuns=None):
+    # Same as facingSortOrder, but it yields the serial numbers one by
+    # one, after sorting fixed-width records on disk: sorted runs of at
+    # most maxInMemory records are written to temporary files, then
+    # merged
+    maxOpenRuns = maxOpenRuns or maxOpenRunsForLimit()
+    seqRanks = sequenceRanks(table)
+    pack = edgeSortRecord.pack
+    seqIds = table.seqIds
+    coords = table.coords
+    isStarts = table.isStarts
+    runs = []
+    records = []
+    for i in range(len(table)):
+        records.append(pack(i & 1, seqRanks[seqIds[i]], coords[i],
+                            isStarts[i], i))
+        if len(records) >= maxInMemory or i + 1 == len(table):
+            records.sort()
+            f = tempfile.TemporaryFile()
+            f.write(b"".join(records))
+            runs.append(f)
+            records = []
+            if len(runs) == maxOpenRuns: runs = [mergedEdgeSortRun(runs)]
+    merged = heapq.merge(*[edgeSortRecordsFromRun(f) for f in runs])
+    for record in merged:
+        yield edgeSortRecord.unpack(record)[-1]
+
+def nearbyEdgePairs(table, order, maxDistance):
+    # the order can be an iterator: it is read once, from start to end
+    for k, i in enumerate(order):
+        if k % 2:
+            assert not table.isStarts[i]
+            previous = i
         else:
-            assert x[4] == "start"
-            if i > 0:
-                y = edges[i-1]
-                if isFacing(y, x, maxDistance, unorderedGaps):
-                    facing = y[0]
-        x.append(facing)
+            assert table.isStarts[i]
+            if k and isNearby(table, previous, i, maxDistance):
+                yield previous, i
+
+def subtableSortOrder(order, wanted, numOfEdges):
+    # Get the facingSortOrder of an edgeSubtable, from the order of the
+    # full table, without sorting again
+    if len(wanted) * 4 == numOfEdges: return order
+    newSerials = array.array("i", [-1]) * numOfEdges
+    for newK, k in enumerate(wanted):
+        for x in range(4):
+            newSerials[k * 4 + x] = newK * 4 + x
+    return [newSerials[i] for i in order if newSerials[i] >= 0]
+
+def findFacingEdges(table, maxDistance, unorderedGaps, order=None,
+                    facing=None):
+    if facing is None: facing = array.array("i", [-1]) * len(table)
+    table.facing = facing
+    if order is None: order = facingSortOrder(table)
+    pairs = nearbyEdgePairs(table, order, maxDistance)
+    genomeAndSeq = lambda pair: (pair[0] & 1, table.seqIds[pair[0]])
+    for (g, seqId), group in itertools.groupby(pairs, genomeAndSeq):
+        group, rangePairs = itertools.tee(group)
+        seqName = chromosomeNameOnly(table.seqNames[seqId])
+        seqGaps = unorderedGaps[g].get(seqName)
+        ranges = ((table.coords[i], table.coords[j]) for i, j in rangePairs)
+        isGapFree = isGapFreeRanges(seqGaps, ranges)
+        for i, j in group:
+            if next(isGapFree):
+                facing[i] = j
+                facing[j] = i
+                counts["facingLinks"] += 1
 
 def isClosedLoop(linkedEdges):
     return linkedEdges[0][6] >= 0
@@ -168,15 +694,43 @@ def edgeOrGapsToString(e):
     except:
         return "gap" + ",".join(str(gapLength(i)) for i in e)
 
-def printMe(edgesAndGaps):
-    out = map(edgeOrGapsToString, edgesAndGaps)
-    print(*out)
+def genomeAndSequence(seqName):  # e.g. "hg19.chr2" -> "hg19", "chr2"
+    genome, dot, sequence = seqName.partition(".")
+    if not dot: return "", seqName
+    return genome, sequence
+
+def edgeRecord(e, gapList):
+    genome, sequence = genomeAndSequence(e[2])
+    gapText = ",".join(str(gapLength(i)) for i in gapList) or "."
+    return "\t".join((genome, sequence, str(e[3]), e[4], gapText))
+
+def rearrangementRecords(linkedEdges, gaps):
+    # The TSV records of one rearrangement, without ids, joined by spaces
+    records = []
+    for i, x in enumerate(linkedEdges):
+        gapList = ()
+        if i + 1 < len(linkedEdges):
+            y = linkedEdges[i + 1]
+            if x[1] == y[1]: gapList = gapsBetween(x, y, gaps)
+        records.append(edgeRecord(x, gapList))
+    return " ".join(records)
+
+def writeRearrangementTexts(texts, outputFormat, outFile=sys.stdout):
+    # Write rearrangementText()s, giving TSV records their ids
+    if outputFormat == "tsv":
+        print(U.tsvHeader, file=outFile)
+        for n, text in enumerate(texts):
+            for record in text.split(" "):
+                print(n + 1, record, sep="\t", file=outFile)
+    else:
+        for text in texts:
+            print(text, file=outFile)
 
 def isCompatibleEdges(x, y, unorderedGaps):
     xSeqName = x[2]
     ySeqName = y[2]
     if xSeqName == ySeqName:
-        return gapsBetween(x, y, unorderedGaps)
+        return isGapBetween(x, y, unorderedGaps)
     else:
         return isCompatibleSequenceNames(xSeqName, ySeqName)
 
@@ -196,7 +750,7 @@ def isGapFill(linkedEdges, gaps, unorderedGaps):
     if e1[4] == e6[4]: return False
     if e1[4] > e6[4] and e1[3] >= e6[3]: return False
     if e1[4] < e6[4] and e1[3] <= e6[3]: return False
-    if not gapsBetween(e3, e4, gaps): return False
+    if not isGapBetween(e3, e4, gaps): return False
     if not isCompatibleEdges(e0, e3, unorderedGaps): return False
     if not isCompatibleEdges(e7, e3, unorderedGaps): return False
     return True
@@ -206,56 +760,394 @@ def isRearranged(linkedEdges, gaps, unorderedGaps):
     assert not n % 2
     if n == 4 and isClosedLoop(linkedEdges): return False
     if n < 4: return False
-    if isEndJoin(linkedEdges, unorderedGaps): return False
-    if isGapFill(linkedEdges, gaps, unorderedGaps): return False
+    if isEndJoin(linkedEdges, unorderedGaps):
+        counts["chainsRejectedByIsEndJoin"] += 1
+        return False
+    if isGapFill(linkedEdges, gaps, unorderedGaps):
+        counts["chainsRejectedByIsGapFill"] += 1
+        return False
     return True
 
-def getLinkedEdges(edges, gaps, unorderedGaps):
-    edges.sort()
-    for x in edges:
-        linkedEdges = []
-        y = x
-        while 1:
-            if y[0] < 0: break
-            linkedEdges.append(y)
-            y[0] = -1
-            facing = y[6]
-            if facing < 0: break
-            y = edges[facing]
-            linkedEdges.append(y)
-            y[0] = -1
-            aligned = y[5]
-            y = edges[aligned]
-        y = x
-        while 1:
-            aligned = y[5]
-            y = edges[aligned]
-            if y[0] < 0: break
-            linkedEdges.insert(0, y)
-            y[0] = -1
-            facing = y[6]
-            if facing < 0: break
-            y = edges[facing]
-            linkedEdges.insert(0, y)
-            y[0] = -1
+def linkedEdgeChain(facing, isVisited, x):
+    # Walk forwards and backwards from edge x, via facing and aligned
+    # edges, without modifying the edge table.  This is linear in the
+    # chain length.
+    chain = collections.deque()
+    y = x
+    while 1:
+        if isVisited[y]: break
+        chain.append(y)
+        isVisited[y] = 1
+        y = facing[y]
+        if y < 0: break
+        chain.append(y)
+        isVisited[y] = 1
+        y = edgeAligned(y)
+    y = x
+    while 1:
+        y = edgeAligned(y)
+        if isVisited[y]: break
+        chain.appendleft(y)
+        isVisited[y] = 1
+        y = facing[y]
+        if y < 0: break
+        chain.appendleft(y)
+        isVisited[y] = 1
+    return chain
+
+def getLinkedEdges(table, gaps, unorderedGaps):
+    isVisited = bytearray(len(table))
+    for x in range(len(table)):
+        if isVisited[x]: continue
+        chain = linkedEdgeChain(table.facing, isVisited, x)
+        chainLengthCounts[len(chain)] += 1
+        if len(chain) < 4: continue  # can't be rearranged
+        linkedEdges = [edgeAt(table, i) for i in chain]
         if isRearranged(linkedEdges, gaps, unorderedGaps):
+            counts["rearrangements"] += 1
             yield linkedEdges
 
 def sortKey(linkedEdges):
     return linkedEdges[0][1:5]
 
-def genomeRearrangements(opts, args):
-    gaps1, unorderedGaps1 = getGaps(opts.gap1)
-    gaps2, unorderedGaps2 = getGaps(opts.gap2)
+def rearrangementsFromTable(table, maxDistance, gaps, unorderedGaps,
+                            order=None):
+    findFacingEdges(table, maxDistance, unorderedGaps, order)
+    e = getLinkedEdges(table, gaps, unorderedGaps)
+    return sorted(e, key=sortKey)
+
+def rearrangementText(linkedEdges, gaps, outputFormat):
+    if outputFormat == "tsv": return rearrangementRecords(linkedEdges, gaps)
+    j = linkedEdgesAndGaps(linkedEdges, gaps)
+    return " ".join(map(edgeOrGapsToString, j))
+
+def spilledRun(records):
+    f = tempfile.TemporaryFile("w+")
+    for key, text in records:
+        f.write("%d\t%s\t%d\t%s\t%d\t%s\n" % (key + (text,)))
+    f.seek(0)
+    return f
+
+def recordsFromRun(lines):
+    for line in lines:
+        genome, seqName, coordinate, edgeType, serial, text = \
+            line.rstrip("\n").split("\t", 5)
+        key = int(genome), seqName, int(coordinate), edgeType, int(serial)
+        yield key, text
+
+def mergedRearrangementRun(runs):
+    f = spilledRun(heapq.merge(*[recordsFromRun(i) for i in runs]))
+    for i in runs: i.close()
+    return f
+
+def sortedRearrangementTexts(linkedEdgeChains, gaps, outputFormat,
+                             maxInMemory, maxOpenRuns=None):
+    # Same order as sorted(linkedEdgeChains, key=sortKey), but with at
+    # most maxInMemory rearrangements in memory: sorted runs are spilled
+    # to temporary files, and merged at the end (in groups, if there
+    # are too many to have open at once)
+    maxOpenRuns = maxOpenRuns or maxOpenRunsForLimit()
+    runs = []
+    records = []
+    for serial, linkedEdges in enumerate(linkedEdgeChains):
+        key = tuple(sortKey(linkedEdges)) + (serial,)
+        text = rearrangementText(linkedEdges, gaps, outputFormat)
+        records.append((key, text))
+        if len(records) >= maxInMemory:
+            records.sort()
+            runs.append(spilledRun(records))
+            records = []
+            if len(runs) == maxOpenRuns: runs = [mergedRearrangementRun(runs)]
+    records.sort()
+    merged = heapq.merge(records, *[recordsFromRun(i) for i in runs])
+    for key, text in merged:
+        yield text
+
+def writeRearrangements(rearrangements, gaps, outputFormat,
+                        outFile=sys.stdout):
+    texts = (rearrangementText(i, gaps, outputFormat) for i in rearrangements)
+    writeRearrangementTexts(texts, outputFormat, outFile)
+
+def bothGenomeGaps(opts):
+    if opts.cache_dir:
+        gaps1, unorderedGaps1 = cachedGaps(opts.cache_dir, opts.gap1)
+        gaps2, unorderedGaps2 = cachedGaps(opts.cache_dir, opts.gap2)
+    else:
+        gaps1, unorderedGaps1 = getGaps(opts.gap1)
+        gaps2, unorderedGaps2 = getGaps(opts.gap2)
+    return (gaps1, gaps2), (unorderedGaps1, unorderedGaps2)
+
+def sweepFileName(prefix, maxMismap, maxDistance):
+    return "%s.m%g.d%g.txt" % (prefix, maxMismap, maxDistance)
+
+sweepData = None  # shared with sweep worker processes
+
+def setSweepData(*args):
+    global sweepData
+    sweepData = args
+
+def sweepOneCombination(args):  # can run in a worker process
+    maxMismap, maxDistance, fileName = args
+    table, order, gaps, unorderedGaps, outputFormat = sweepData
+    wanted = wantedAlignments(table, maxMismap)
+    subtable = edgeSubtable(table, wanted)
+    suborder = subtableSortOrder(order, wanted, len(table))
+    r = rearrangementsFromTable(subtable, maxDistance, gaps, unorderedGaps,
+                                suborder)
+    outFile = open(fileName, "w")
+    writeRearrangements(r, gaps, outputFormat, outFile)
+    outFile.close()
+    return maxMismap, maxDistance, len(r), fileName
+
+def sweepRearrangements(opts, args, gaps, unorderedGaps):
+    # Parse and sort the edges of all alignments once, then find
+    # rearrangements for each combination of mismap and distance limits
+    if opts.cache_dir and args[0] != '-':
+        table = cachedEdgeTable(opts.cache_dir, args[0], opts.jobs)
+    else:
+        table = edgeTableFromMaf(args[0], float("inf"), opts.jobs)
+    order = facingSortOrder(table)
+    mismaps = opts.sweep_mismap or [opts.mismap]
+    distances = opts.sweep_distance or [opts.distance]
+    jobs = [(m, d, sweepFileName(opts.sweep_prefix, m, d))
+            for m in mismaps for d in distances]
+    sweepArgs = table, order, gaps, unorderedGaps, opts.format
+    if opts.jobs > 1:
+        pool = U.forkPool(opts.jobs, setSweepData, sweepArgs)
+        results = pool.map(sweepOneCombination, jobs)
+        pool.close()
+        pool.join()
+    else:
+        setSweepData(*sweepArgs)
+        results = [sweepOneCombination(i) for i in jobs]
+    print("#mismap", "distance", "rearrangements", "file", sep="\t")
+    for maxMismap, maxDistance, count, fileName in results:
+        print("%g" % maxMismap, "%g" % maxDistance, count, fileName, sep="\t")
+
+def regionSeeds(index, region):
+    # Get the edges in the region, in either genome
+    header, columns = index
+    name, beg, end = region
+    orderCoords = columns["orderCoords"]
+    for genome, seqName, rangeBeg, rangeEnd in header["seqRanges"]:
+        if seqName != name: continue
+        lo = bisect.bisect_left(orderCoords, beg, rangeBeg, rangeEnd)
+        hi = bisect.bisect_right(orderCoords, end, lo, rangeEnd)
+        for k in range(lo, hi):
+            yield columns["order"][k]
+
+def facingEdgeInIndex(index, rangeBegs, i, opts, unorderedGaps):
+    # Get the edge that edge i faces in a run on the whole MAF, or -1:
+    # the same as findFacingEdges, but only for this edge
+    header, columns = index
+    order = columns["order"]
+    coords = columns["coords"]
+    mismaps = columns["mismaps"]
+    k = columns["ranks"][i]
+    genome, seqName, rangeBeg, rangeEnd = \
+        header["seqRanges"][bisect.bisect(rangeBegs, k) - 1]
+    step = -1 if columns["isStarts"][i] else 1
+    k += step
+    while rangeBeg <= k < rangeEnd and mismaps[order[k] >> 2] > opts.mismap:
+        k += step
+    if not rangeBeg <= k < rangeEnd: return -1
+    j = order[k]
+    beg, end = sorted((coords[i], coords[j]))
+    if end - beg > opts.distance: return -1
+    seqGaps = unorderedGaps[genome - 1].get(chromosomeNameOnly(seqName))
+    if not next(isGapFreeRanges(seqGaps, [(beg, end)])): return -1
+    return j
+
+def regionAlignments(index, opts, unorderedGaps):
+    # Get the alignments in all chains with edges in the region, by
+    # following aligned and facing edges from the edges in the region
+    header, columns = index
+    rangeBegs = [i[2] for i in header["seqRanges"]]
+    mismaps = columns["mismaps"]
+    todo = [i for i in regionSeeds(index, opts.region)
+            if mismaps[i >> 2] <= opts.mismap]
+    seen = set(todo)
+    while todo:
+        i = todo.pop()
+        j = facingEdgeInIndex(index, rangeBegs, i, opts, unorderedGaps)
+        for x in edgeAligned(i), j:
+            if x >= 0 and x not in seen:
+                seen.add(x)
+                todo.append(x)
+    return sorted(set(i >> 2 for i in seen))
+
+def edgeTableFromMafBlocks(fileName, offsets, alignmentNumbers, maxMismap):
+    table = EdgeTable()
+    seqIdDict = {}
+    buf = U.mmapOrNone(fileName)
+    for k in alignmentNumbers:
+        end = offsets[k + 1] if k + 1 < len(offsets) else len(buf)
+        addMafEdges(table, seqIdDict, buf, maxMismap, offsets[k], end)
+    return table
+
+def isInRegion(linkedEdges, region):
+    name, beg, end = region
+    return any(e[2] == name and beg <= e[3] <= end for e in linkedEdges)
+
+def regionRearrangements(opts, args, gaps, unorderedGaps):
+    # Same as the lines of a run on the whole MAF that have edges in
+    # the region, in the same order: the alignments' serial numbers are
+    # in the same order, so the chains are found the same way
+    with stage("readMafIndex"):
+        index = mafIndex(opts.cache_dir, args[0])
+    with stage("regionAlignments"):
+        alignmentNumbers = regionAlignments(index, opts, unorderedGaps)
+        offsets = index[1]["offsets"]
+        table = edgeTableFromMafBlocks(args[0], offsets, alignmentNumbers,
+                                       opts.mismap)
+    counts["edges"] += len(table)
+    with stage("findRearrangements"):
+        r = rearrangementsFromTable(table, opts.distance, gaps, unorderedGaps)
+        writeRearrangements([i for i in r if isInRegion(i, opts.region)],
+                            gaps, opts.format)
+
+def batchPairs(fileName):
+    # Each line has: MAF file, genome2 gap file (optional), output file
+    # (optional, default: the MAF file name with .txt instead of .maf)
+    for line in U.myOpen(fileName):
+        fields = line.split()
+        if not fields or fields[0][0] == "#": continue
+        mafFileName = fields[0]
+        gapFileName = fields[1] if len(fields) > 1 else None
+        if len(fields) > 2:
+            outFileName = fields[2]
+        else:
+            base = os.path.basename(mafFileName)
+            if base.endswith(".maf"): base = base[:-4]
+            outFileName = base + ".txt"
+        yield mafFileName, gapFileName, outFileName
+
+batchData = None  # shared with batch worker processes
+
+def setBatchData(*args):
+    global batchData
+    batchData = args
+
+def batchOnePair(args):  # can run in a worker process
+    mafFileName, gapFileName, outFileName = args
+    gaps1, unorderedGaps1, opts = batchData
+    wall = time.time()
+    cpu = U.cpuSeconds()
+    if opts.cache_dir:
+        gaps2, unorderedGaps2 = cachedGaps(opts.cache_dir, gapFileName)
+        table = cachedEdgeTable(opts.cache_dir, mafFileName, 1)
+        table = edgeTableWithMaxMismap(table, opts.mismap)
+    else:
+        gaps2, unorderedGaps2 = getGaps(gapFileName)
+        table = edgeTableFromMaf(mafFileName, opts.mismap)
     gaps = gaps1, gaps2
     unorderedGaps = unorderedGaps1, unorderedGaps2
-    edges = list(alignmentEdgesFromMaf(myOpen(args[0]), opts.mismap))
-    appendFacingSerialNumbers(edges, opts.distance, unorderedGaps)
-    e = getLinkedEdges(edges, gaps, unorderedGaps)
-    s = sorted(e, key=sortKey)
-    for i in s:
-        j = linkedEdgesAndGaps(i, gaps)
-        printMe(j)
+    r = rearrangementsFromTable(table, opts.distance, gaps, unorderedGaps)
+    outFile = open(outFileName, "w")
+    writeRearrangements(r, gaps, opts.format, outFile)
+    outFile.close()
+    return (mafFileName, len(table), len(r), round(time.time() - wall, 3),
+            round(U.cpuSeconds() - cpu, 3), outFileName)
+
+def batchRearrangements(opts, gaps1, unorderedGaps1):
+    # Find rearrangements for many pairs of genomes that share genome1,
+    # whose gaps are read once.  The biggest MAF files go first, so that
+    # the slowest pairs don't start last.
+    jobs = list(batchPairs(opts.batch))
+    mafSizes = [os.path.getsize(i[0]) for i in jobs]
+    order = sorted(range(len(jobs)), key=lambda i: -mafSizes[i])
+    batchArgs = gaps1, unorderedGaps1, opts
+    if opts.jobs > 1:  # the workers get genome1's gaps by fork
+        pool = U.forkPool(opts.jobs, setBatchData, batchArgs)
+        results = pool.map(batchOnePair, [jobs[i] for i in order], 1)
+        pool.close()
+        pool.join()
+    else:
+        setBatchData(*batchArgs)
+        results = [batchOnePair(jobs[i]) for i in order]
+    results = sorted(zip(order, results))
+    print("#maf", "edges", "rearrangements", "wallSeconds", "cpuSeconds",
+          "file", sep="\t")
+    for i, result in results:
+        print(*result, sep="\t")
+        counts["edges"] += result[1]
+        counts["rearrangements"] += result[2]
+    counts["pairs"] = len(results)
+
+def genomeRearrangements(opts, args):
+    if opts.batch:
+        with stage("readGaps"):
+            if opts.cache_dir: gaps1 = cachedGaps(opts.cache_dir, opts.gap1)
+            else:              gaps1 = getGaps(opts.gap1)
+        with stage("batch"):
+            return batchRearrangements(opts, *gaps1)
+    with stage("readGaps"):
+        gaps, unorderedGaps = bothGenomeGaps(opts)
+    if opts.region:
+        return regionRearrangements(opts, args, gaps, unorderedGaps)
+    if opts.sweep_mismap or opts.sweep_distance:
+        with stage("sweep"):
+            return sweepRearrangements(opts, args, gaps, unorderedGaps)
+    with stage("readMaf"):
+        if opts.cache_dir and args[0] != '-':
+            table = cachedEdgeTable(opts.cache_dir, args[0], opts.jobs)
+            table = edgeTableWithMaxMismap(table, opts.mismap)
+        elif opts.max_memory:
+            table = edgeTableFromMafWithMaxMemory(args[0], opts.mismap,
+                                                  opts.max_memory)
+        else:
+            table = edgeTableFromMaf(args[0], opts.mismap, opts.jobs)
+    counts["edges"] += len(table)
+    maxMemory = opts.max_memory
+    order = facing = None
+    sortBuffer = opts.sort_buffer
+    if maxMemory and len(table) * inMemoryBytesPerEdge > maxMemory:
+        maxInMemory = max(maxMemory // inMemoryBytesPerEdge, 1 << 16)
+        order = externalSortOrder(table, maxInMemory)
+        facing = writableDiskColumn("i", len(table), -1)
+        sortBuffer = sortBuffer or maxInMemory
+    if opts.unsorted or sortBuffer:
+        with stage("findFacingEdges"):
+            findFacingEdges(table, opts.distance, unorderedGaps, order, facing)
+        with stage("linkSortAndWrite"):
+            e = getLinkedEdges(table, gaps, unorderedGaps)
+            if opts.unsorted:
+                texts = (rearrangementText(i, gaps, opts.format) for i in e)
+            else:
+                texts = sortedRearrangementTexts(e, gaps, opts.format,
+                                                 sortBuffer)
+            writeRearrangementTexts(texts, opts.format)
+    else:
+        with stage("facingSort"):
+            order = facingSortOrder(table)
+        with stage("findFacingEdges"):
+            findFacingEdges(table, opts.distance, unorderedGaps, order)
+        with stage("linkEdges"):
+            e = list(getLinkedEdges(table, gaps, unorderedGaps))
+        with stage("sortAndWrite"):
+            writeRearrangements(sorted(e, key=sortKey), gaps, opts.format)
+
+def memorySize(option, optionString, value, parser):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    try:
+        if value[-1:].upper() in units:
+            size = int(float(value[:-1]) * units[value[-1:].upper()])
+        else:
+            size = int(value)
+    except ValueError:
+        parser.error("bad memory size: " + value)
+    setattr(parser.values, option.dest, size)
+
+def genomeRegion(option, optionString, value, parser):
+    m = re.match(r"(.+):(\d+)-(\d+)$", value.replace(",", ""))
+    if not m: parser.error("bad region: " + value)
+    region = m.group(1), int(m.group(2)), int(m.group(3))
+    setattr(parser.values, option.dest, region)
+
+def floatList(option, optionString, value, parser):
+    try: values = [float(i) for i in value.split(",")]
+    except ValueError: parser.error("bad list of numbers: " + value)
+    setattr(parser.values, option.dest, values)
 
 if __name__ == "__main__":
     signal.signal(signal.SIGPIPE, signal.SIG_DFL)  # avoid silly error message
@@ -268,8 +1160,58 @@ if __name__ == "__main__":
                   help="read genome2 assembly gaps from agp or gap file")
     op.add_option("-m", "--mismap", metavar="PROB", type="float", default=1e-5,
                   help="omit alignments with mismap probability > PROB (default: %default)")
+    op.add_option("-d", "--distance", metavar="BASES", type="float",
+                  default=1e9, help="maximum distance between facing "
+                  "alignment edges (default: %default)")
+    op.add_option("-j", "--jobs", metavar="N", type="int", default=1,
+                  help="use N parallel processes (default: %default)")
+    op.add_option("-c", "--cache-dir", metavar="DIR",
+                  help="reuse parsed inputs cached in DIR, and cache new ones there")
+    op.add_option("-u", "--unsorted", action="store_true",
+                  help="write rearrangements as soon as they are found, unsorted")
+    op.add_option("-b", "--sort-buffer", metavar="N", type="int",
+                  help="sort at most N rearrangements in memory, "
+                  "using temporary files for the rest")
+    op.add_option("-M", "--max-memory", metavar="BYTES", type="string",
+                  action="callback", callback=memorySize,
+                  help="if the alignment edges need more than this much "
+                  "memory (e.g. 8G), keep them in temporary files")
+    op.add_option("-s", "--stats", metavar="FILE",
+                  help="write run times, memory use, and counts to FILE, "
+                  "as JSON, and show progress")
+    op.add_option("--sweep-mismap", metavar="PROBS", type="string",
+                  action="callback", callback=floatList,
+                  help="write rearrangements for each of these comma-separated mismap limits")
+    op.add_option("--sweep-distance", metavar="BASES", type="string",
+                  action="callback", callback=floatList,
+                  help="write rearrangements for each of these comma-separated distance limits")
+    op.add_option("--sweep-prefix", metavar="PREFIX", default="rearrangements",
+                  help="sweep output file name prefix (default: %default)")
+    op.add_option("--batch", metavar="FILE", help="find rearrangements for "
+                  "each line of FILE: MAF file, genome2 gap file, output "
+                  "file (the last two are optional), and write a summary")
+    op.add_option("--region", metavar="SEQ:BEG-END", type="string",
+                  action="callback", callback=genomeRegion,
+                  help="only find rearrangements with edges in this region "
+                  "(e.g. hg19.chr2:1000000-2000000), using an index of the "
+                  "uncompressed MAF file, which is made if need be, and "
+                  "written next to it as FILE.index (or in the -c DIR)")
+    op.add_option("-f", "--format", type="choice", choices=("text", "tsv"),
+                  default="text", help="output format: text, or tsv with "
+                  "one line per edge (default: %default)")
     opts, args = op.parse_args()
-    if len(args) != 1: op.error("I need 1 file name")
-    #opts.distance = 1000  # xxx ???
-    opts.distance = 1e9
+    if opts.region:
+        if opts.batch or opts.sweep_mismap or opts.sweep_distance:
+            op.error("option --region can't be used with --batch or --sweep-*")
+        if args == ['-']: op.error("option --region needs a MAF file, not '-'")
+        if len(args) == 1 and U.mmapOrNone(args[0]) is None:
+            op.error("option --region needs an uncompressed, non-empty MAF file")
+    if opts.batch:
+        if args: op.error("I need no file names with --batch")
+        if opts.gap2: op.error("option -2 can't be used with --batch")
+        if opts.sweep_mismap or opts.sweep_distance:
+            op.error("options --batch and --sweep-* can't be used together")
+    elif len(args) != 1: op.error("I need 1 file name")
+    if opts.stats: progressSeconds = 10
     genomeRearrangements(opts, args)
+    if opts.stats: U.writeStats(opts.stats, chainLengths=chainLengthCounts)
@@ -7,11 +7,13 @@
 
 from __future__ import print_function
 
-import bisect, operator, optparse, signal, sys
+import array, bisect, collections, glob, itertools, optparse, signal, sys
 
-def myOpen(fileName):  # faster than fileinput
-    if fileName == '-': return sys.stdin
-    else:               return open(fileName)
+import rearrangementutils as U
+
+# Run statistics, written as JSON by the --stats option
+counts = U.counts
+stage = U.stage
 
 def isExtraPslField(fields):
     return fields[9] in "+-"
@@ -58,45 +60,170 @@ def readGenes(lines):
         ejList.append(exonJunctions)
     return genes
 
-def isMultiExon(alignmentBeg, alignmentEnd, exonJunctions):
-    # does the alignment extend at least X bp either side of any junction?
+# A junction index has, for each transcript (sorted by name): its
+# length, and the exon junctions of all its isoforms, merged, sorted,
+# and deduplicated.  The junctions are stored one transcript after
+# another, in columns: names, lengths, ends of each transcript's
+# junctions, and junctions.
+def junctionIndex(genes):
+    names = sorted(genes)
+    qSizes = array.array("l")
+    junctionEnds = array.array("l")
+    junctions = array.array("l")
+    for name in names:
+        qSize, ejList = genes[name]
+        qSizes.append(int(qSize))
+        junctions.extend(sorted(set(itertools.chain.from_iterable(ejList))))
+        junctionEnds.append(len(junctions))
+    return names, qSizes, junctionEnds, junctions
+
+# The splice junction index is cached with rearrangementutils.writeCache
+cacheMagic = b"last-spliced-retroseqs cache 1\n"
+
+def cachedJunctionIndex(cacheDir, fileName):
+    if not U.isRegularFile(fileName):
+        return junctionIndex(readGenes(U.myOpen(fileName)))
+    path = U.cachePath(cacheDir, fileName, "junctions.cache")
+    signature = U.inputSignature(fileName)
+    cached = U.readCache(path, cacheMagic, signature)
+    if cached:
+        header, c = cached
+        return header["names"], c["qSizes"], c["junctionEnds"], c["junctions"]
+    names, qSizes, junctionEnds, junctions = junctionIndex(
+        readGenes(U.myOpen(fileName)))
+    columns = [("qSizes", "l", qSizes), ("junctionEnds", "l", junctionEnds),
+               ("junctions", "l", junctions)]
+    U.writeCache(path, cacheMagic, dict(signature, names=names), columns)
+    return names, qSizes, junctionEnds, junctions
+
+def isMultiExon(alignmentBeg, alignmentEnd, exonJunctions, beg, end):
+    # does the alignment extend at least X bp either side of any junction
+    # in exonJunctions[beg:end]?
     minBasesPastJunction = 50
-    i = bisect.bisect_left(exonJunctions, alignmentBeg + minBasesPastJunction)
-    j = bisect.bisect_right(exonJunctions, alignmentEnd - minBasesPastJunction)
+    i = bisect.bisect_left(exonJunctions, alignmentBeg + minBasesPastJunction,
+                           beg, end)
+    j = bisect.bisect_right(exonJunctions, alignmentEnd - minBasesPastJunction,
+                            beg, end)
     return i < j
 
 def isBigInsertion(lastAlignmentBlocks):
     maxInsertLength = 20
-    for i in lastAlignmentBlocks.split(","):
-        if ":" in i:
-            delete, insert = i.split(":")
+    if b":" not in lastAlignmentBlocks: return False
+    for i in lastAlignmentBlocks.split(b","):
+        if b":" in i:
+            delete, insert = i.split(b":")
             if int(insert) > maxInsertLength: return True
     return False
 
-def lastSplicedRetroseqs(opts, args):
-    genesFile = myOpen(args[0])
-    genes = readGenes(genesFile)
-    lastFile = myOpen(args[1])
-    for line in lastFile:
-        if not line[0] == "#":
-            fields = line.split()
-            name = fields[1]
-            if name not in genes: continue
-            qSize, ejList = genes[name]
+def lastFileNames(args):
+    # Expand glob patterns, e.g. for per-chromosome lastal outputs
+    for i in args:
+        fileNames = sorted(glob.glob(i)) if i != '-' else []
+        for j in fileNames or [i]:
+            yield j
+
+def lineChunks(fileNames, chunkSize=1<<22):
+    # Yield chunks of whole lines, as bytes
+    for fileName in fileNames:
+        f = U.myOpenBytes(fileName)
+        tail = b""
+        while 1:
+            data = f.read(chunkSize)
+            if not data: break
+            end = data.rfind(b"\n") + 1
+            if end:
+                yield tail + data[:end]
+                tail = data[end:]
+            else:
+                tail += data
+        if tail: yield tail + b"\n"
+
+filterData = None  # shared with worker processes
+
+def setFilterData(*args):
+    global filterData
+    filterData = args
+
+def filteredChunk(chunk):  # can run in a worker process
+    genes, qSizes, junctionEnds, junctions = filterData
+    numOfAlignments = numNotInGenes = numNotMultiExon = 0
+    numWithWrongLength = numWithBigInsertion = numWritten = 0
+    lines = chunk.split(b"\n")
+    lines.pop()  # empty, because the chunk ends with a newline
+    out = []
+    for line in lines:
+        if line[:1] != b"#":
+            numOfAlignments += 1
+            name = line.split(None, 2)[1]  # check this before parsing more
+            if name not in genes:
+                numNotInGenes += 1
+                continue
+            fields = line.split(None, 12)
+            k = genes[name]
             beg = int(fields[2])
             end = beg + int(fields[3])
-            if not any(isMultiExon(beg, end, i) for i in ejList): continue
-            seqlen = fields[5]
-            if seqlen != qSize: continue  # can happen, sadly
+            junctionBeg = junctionEnds[k - 1] if k else 0
+            if not isMultiExon(beg, end, junctions, junctionBeg,
+                               junctionEnds[k]):
+                numNotMultiExon += 1
+                continue
+            seqlen = int(fields[5])
+            if seqlen != qSizes[k]:  # can happen, sadly
+                numWithWrongLength += 1
+                continue
             blocks = fields[11]
-            if isBigInsertion(blocks): continue
-        print(line, end="")
+            if isBigInsertion(blocks):
+                numWithBigInsertion += 1
+                continue
+            numWritten += 1
+        out.append(line)
+    out.append(b"")
+    chunkCounts = collections.Counter({
+        "alignments": numOfAlignments,
+        "alignmentsNotInGenes": numNotInGenes,
+        "alignmentsNotMultiExon": numNotMultiExon,
+        "alignmentsWithWrongLength": numWithWrongLength,
+        "alignmentsWithBigInsertion": numWithBigInsertion,
+        "alignmentsWritten": numWritten})
+    return b"\n".join(out) if len(out) > 1 else b"", chunkCounts
+
+def lastSplicedRetroseqs(opts, args):
+    with stage("readGenes"):
+        if opts.cache_dir and args[0] != '-':
+            index = cachedJunctionIndex(opts.cache_dir, args[0])
+        else:
+            index = junctionIndex(readGenes(U.myOpen(args[0])))
+        names, qSizes, junctionEnds, junctions = index
+        genes = dict((name.encode(), i) for i, name in enumerate(names))
+        setFilterData(genes, qSizes, junctionEnds, junctions)
+    counts["transcripts"] = len(genes)
+    with stage("filter"):
+        chunks = lineChunks(lastFileNames(args[1:]))
+        if opts.jobs > 1:  # the workers get the genes by fork
+            pool = U.forkPool(opts.jobs, setFilterData, filterData)
+            results = pool.imap(filteredChunk, chunks)
+        else:
+            results = (filteredChunk(i) for i in chunks)
+        out = getattr(sys.stdout, "buffer", sys.stdout)
+        for text, chunkCounts in results:
+            out.write(text)
+            counts.update(chunkCounts)
+        if opts.jobs > 1:
+            pool.close()
+            pool.join()
 
 if __name__ == "__main__":
     signal.signal(signal.SIGPIPE, signal.SIG_DFL)  # avoid silly error message
-    usage = "%prog refSeqAli.txt alignments.tab > retros.tab"
+    usage = "%prog refSeqAli.txt alignments.tab [more.tab ...] > retros.tab"
     description = "Get spliced retrosequences, from genome-RNA alignments in LAST tabular format."
     op = optparse.OptionParser(usage=usage, description=description)
+    op.add_option("-c", "--cache-dir", metavar="DIR",
+                  help="reuse junction indexes cached in DIR, and cache new ones there")
+    op.add_option("-j", "--jobs", metavar="N", type="int", default=1,
+                  help="use N parallel processes (default: %default)")
+    op.add_option("-s", "--stats", metavar="FILE",
+                  help="write run times, memory use, and counts to FILE, as JSON")
     opts, args = op.parse_args()
-    if len(args) != 2: op.error("I need 2 file names")
+    if len(args) < 2: op.error("I need at least 2 file names")
     lastSplicedRetroseqs(opts, args)
+    if opts.stats: U.writeStats(opts.stats)
@@ -0,0 +1,29 @@
+#! /usr/bin/env python
+# Copyright 2016 Martin C. Frith
+
+# Convert rearrangements between the text format and the TSV format
+# (one line per edge) of genome-rearrangements.py.  The input format is
+# detected from the first line.
+
+from __future__ import print_function
+
+import optparse, signal
+
+import rearrangements as R
+import rearrangementutils as U
+
+def rearrangementConvert(opts, args):
+    lines = U.myOpen(args[0])
+    R.writeRearrangements(R.rearrangementsFromLines(lines), opts.format)
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)  # avoid silly error message
+    usage = "%prog [options] rearrangements"
+    description = "Convert rearrangements from TSV to text format, or the reverse."
+    op = optparse.OptionParser(usage=usage, description=description)
+    op.add_option("-f", "--format", type="choice", choices=("text", "tsv"),
+                  default="text", help="output format: text, or tsv with "
+                  "one line per edge (default: %default)")
+    opts, args = op.parse_args()
+    if len(args) != 1: op.error("I need 1 file name")
+    rearrangementConvert(opts, args)
@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+# Copyright 2016 Martin C. Frith
+
+# Find rearrangements, keep the ones supported by reference
+# rearrangements, and omit the ones that match retrosequences, all in
+# one process.  With -c, each stage's output is cached, so changing a
+# later stage's options doesn't redo the earlier stages.
+
+from __future__ import print_function
+
+import optparse, signal
+
+import rearrangements as R
+
+def detectStage(opts, mafFileName):
+    key = R.stageKey(maf=R.fileSignature(mafFileName),
+                     gap1=R.fileSignature(opts.gap1),
+                     gap2=R.fileSignature(opts.gap2),
+                     mismap=opts.mismap, distance=opts.distance)
+    def compute():
+        return R.genomeRearrangements(mafFileName, opts.gap1, opts.gap2,
+                                      opts.mismap, opts.distance, opts.jobs,
+                                      opts.cache_dir)
+    return key, R.cachedStage(opts.cache_dir, "detect", key, compute)
+
+def supportStage(opts, oldKey, rearrangements):
+    if not opts.ref: return oldKey, rearrangements
+    key = R.stageKey(old=oldKey, refs=[R.fileSignature(i) for i in opts.ref],
+                     distance=opts.support_distance, minRefs=opts.min_refs)
+    def compute():
+        refs = [R.readRearrangementFile(i) for i in opts.ref]
+        R.findAllEquivalentEdges(refs, rearrangements, opts.support_distance)
+        return [i for i in rearrangements if R.isSupported(i, opts.min_refs)]
+    return key, R.cachedStage(opts.cache_dir, "support", key, compute)
+
+def retroIndexStage(opts):
+    if opts.retros:
+        key = R.stageKey(retros=R.fileSignature(opts.retros))
+        compute = lambda: R.readRetros(opts.retros)
+    else:
+        key = R.stageKey(genes=R.fileSignature(opts.genes),
+                         last=[R.fileSignature(i) for i in opts.last])
+        def compute():
+            genes = R.readGenes(opts.genes, opts.cache_dir)
+            return R.retroIndex(R.splicedRetroseqs(genes, opts.last))
+    return key, R.cachedStage(opts.cache_dir, "retros", key, compute)
+
+def retroStage(opts, oldKey, rearrangements):
+    if not opts.retros and not opts.genes: return oldKey, rearrangements
+    retroKey, index = retroIndexStage(opts)
+    key = R.stageKey(old=oldKey, retros=retroKey, genome=opts.genome,
+                     minOverlap=opts.min_overlap)
+    def compute():
+        return [i for i in rearrangements
+                if not R.bestOverlaps(i, index, opts.genome, opts.min_overlap)]
+    return key, R.cachedStage(opts.cache_dir, "retrofilter", key, compute)
+
+def rearrangementPipeline(opts, args):
+    key, r = detectStage(opts, args[0])
+    key, r = supportStage(opts, key, r)
+    key, r = retroStage(opts, key, r)
+    R.writeRearrangements(r, opts.format)
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)  # avoid silly error message
+    usage = "%prog [options] pairwise-alignment-maf-file"
+    description = "Find rearrangements in a one-to-one alignment of 2 genomes, keep ones supported by reference rearrangements, and omit ones that match retrosequences."
+    op = optparse.OptionParser(usage=usage, description=description)
+    op.add_option("-1", "--gap1", metavar="FILE",
+                  help="read genome1 assembly gaps from agp or gap file")
+    op.add_option("-2", "--gap2", metavar="FILE",
+                  help="read genome2 assembly gaps from agp or gap file")
+    op.add_option("-m", "--mismap", metavar="PROB", type="float", default=1e-5,
+                  help="omit alignments with mismap probability > PROB (default: %default)")
+    op.add_option("-d", "--distance", metavar="BASES", type="float",
+                  default=1e9, help="maximum distance between facing "
+                  "alignment edges (default: %default)")
+    op.add_option("-r", "--ref", metavar="FILE", action="append",
+                  help="keep rearrangements supported by the reference "
+                  "rearrangements in FILE (can be used more than once)")
+    op.add_option("-k", "--min-refs", metavar="K",
+                  type="int", default=1, help="an edge is supported if it is "
+                  "supported by at least K references (default: %default)")
+    op.add_option("-D", "--support-distance", metavar="BASES",
+                  type="int", default=1000, help=
+                  "maximum distance to supporting edge (default: %default)")
+    op.add_option("--retros", metavar="FILE",
+                  help="omit rearrangements that match retrosequences in FILE")
+    op.add_option("--genes", metavar="PSL",
+                  help="omit rearrangements that match spliced retrosequences "
+                  "of these genes, found in the --last files")
+    op.add_option("--last", metavar="FILE", action="append",
+                  help="genome-RNA alignments in LAST tabular format "
+                  "(can be used more than once)")
+    op.add_option("-o", "--min-overlap", metavar="FRAC",
+                  type="float", default=0.9,
+                  help="check for overlaps with Jaccard index >= FRAC (default: %default)")
+    op.add_option("-g", "--genome", metavar="NAME", default="hg19",
+                  help="genome name, for retrosequences (default: %default)")
+    op.add_option("-j", "--jobs", metavar="N", type="int", default=1,
+                  help="use N parallel processes (default: %default)")
+    op.add_option("-c", "--cache-dir", metavar="DIR",
+                  help="reuse inputs and stage outputs cached in DIR, "
+                  "and cache new ones there")
+    op.add_option("-f", "--format", type="choice", choices=("text", "tsv"),
+                  default="text", help="output format: text, or tsv with "
+                  "one line per edge (default: %default)")
+    opts, args = op.parse_args()
+    if len(args) != 1: op.error("I need 1 file name")
+    if opts.ref and not 1 <= opts.min_refs <= len(opts.ref):
+        op.error("option -k must be between 1 and the number of references")
+    if opts.retros and opts.genes:
+        op.error("options --retros and --genes can't be used together")
+    if bool(opts.genes) != bool(opts.last):
+        op.error("options --genes and --last must be used together")
+    rearrangementPipeline(opts, args)
@@ -3,11 +3,13 @@
 
 from __future__ import print_function
 
-import bisect, optparse, signal, sys
+import array, bisect, itertools, optparse, signal, sys
 
-def myOpen(fileName):  # faster than fileinput
-    if fileName == '-': return sys.stdin
-    else:               return open(fileName)
+import rearrangementutils as U
+
+# Run statistics, written as JSON by the --stats option
+counts = U.counts
+stage = U.stage
 
 def retroseqFromLine(line):
     fields = line.split()
@@ -25,17 +27,31 @@ def retroseqFromLine(line):
 def retroseqText(r):
     return r[0] + ":" + str(r[1]) + "-" + str(r[2]) + "|" + r[4] + r[3]
 
-def retroseqLength(r):
-    return r[2] - r[1]
-
 def edgeFromText(t):
     head, tail = t.split(":")
     genome, chrom = head.split(".")
-    tail = tail.rstrip("$")
+    tail = tail.rstrip("$01")  # support marks from supported-rearrangements.py -a
     pos = int(tail[:-1])
     bracket = tail[-1]
     return chrom, pos, bracket
 
+def tsvEdges(text, genome):
+    # Get the edges in one genome, from one rearrangement's TSV lines
+    for line in text.splitlines():
+        fields = line.split("\t", 5)
+        if fields[1] == genome:
+            yield fields[2], int(fields[3]), "[" if fields[4] == "start" else "]"
+
+def rearrangementTexts(lines):
+    # Get whether the lines are in TSV format, and the text of each
+    # rearrangement: one line, or all its TSV lines
+    lines = iter(lines)
+    head = next(lines, "")
+    if head.startswith(U.tsvHeader):
+        groups = itertools.groupby(lines, U.tsvId)
+        return True, ("".join(v) for k, v in groups)
+    return False, itertools.chain([head] if head else [], lines)
+
 def overlapJaccardIndex(beg1, end1, beg2, end2):
     assert beg1 <= end1
     assert beg2 <= end2
@@ -44,66 +60,186 @@ def overlapJaccardIndex(beg1, end1, beg2, end2):
     den = max(end1, end2) - min(beg1, beg2)
     return 1.0 * num / den
 
-def bestRetroOverlap(queryChrom, queryBeg, queryEnd, retros, maxRetroLength):
+# A retro index maps each chromosome to its retros, sorted, and a nested
+# containment list of them.  Each list in it holds intervals that don't
+# contain each other, so their starts and ends both increase, and each
+# interval has a sublist of the intervals it contains.  The lists are
+# stored one after another, top list first, in columns: starts, ends,
+# sublist ranges, and numbers of the retros.
+def nestedContainmentList(begs, ends):
+    keys = list(zip(begs, [-i for i in ends]))
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    children = {}
+    stack = []  # each interval in it contains the one above it
+    for i in order:
+        while stack and ends[stack[-1]] < ends[i]: stack.pop()
+        children.setdefault(stack[-1] if stack else -1, []).append(i)
+        stack.append(i)
+    numbers = array.array("l", children.get(-1, ()))
+    subBegs = array.array("l")
+    subEnds = array.array("l")
+    for i in numbers:  # this loop extends numbers, adding each sublist
+        subBegs.append(len(numbers))
+        numbers.extend(children.get(i, ()))
+        subEnds.append(len(numbers))
+    columns = (array.array("l", [begs[i] for i in numbers]),
+               array.array("l", [ends[i] for i in numbers]),
+               subBegs, subEnds, numbers)
+    return len(children.get(-1, ())), columns
+
+def retroIndex(sortedRetros):
+    index = {}
+    for r in sortedRetros:
+        index.setdefault(r[0], []).append(r)
+    for chrom, retros in index.items():
+        begs = [r[1] for r in retros]
+        ends = [r[2] for r in retros]
+        index[chrom] = retros, nestedContainmentList(begs, ends)
+    return index
+
+def overlappingRetros(nestedList, queryBeg, queryEnd, minOverlap):
+    # Get numbers of retros with beg < queryEnd and end > queryBeg,
+    # skipping ones whose Jaccard index with the query must be less than
+    # minOverlap: too short, or starting too far from the query start.
+    # If a retro is too short, so is its sublist.  (The slack allows for
+    # rounding.)
+    topEnd, (begs, ends, subBegs, subEnds, numbers) = nestedList
+    minLength = 0
+    firstBeg = float("-inf")
+    lastBeg = queryEnd - 1
+    if minOverlap > 0:
+        queryLength = queryEnd - queryBeg
+        minLength = minOverlap * queryLength * (1 - 1e-9)
+        maxShift = (1 - minOverlap) / minOverlap * queryLength * (1 + 1e-9)
+        firstBeg = queryBeg - maxShift - 1
+        lastBeg = min(lastBeg, queryBeg + maxShift + 1)
+    todo = [(0, topEnd)]
+    while todo:
+        lo, hi = todo.pop()
+        k = bisect.bisect(ends, queryBeg, lo, hi)
+        while k < hi and begs[k] <= lastBeg:
+            if ends[k] - begs[k] >= minLength:
+                if begs[k] >= firstBeg: yield numbers[k]
+                if subBegs[k] < subEnds[k]:
+                    todo.append((subBegs[k], subEnds[k]))
+            k += 1
+
+def scanRank(i, retro, queryBeg, queryEnd):
+    # ties are broken like the old linear scan: forwards from the
+    # query's sort position, then backwards
+    if retro[1:3] >= (queryBeg, queryEnd): return 0, i
+    return 1, -i
+
+def bestRetroOverlap(queryChrom, queryBeg, queryEnd, index, minOverlap):
+    # Retros with overlap less than minOverlap may be ignored
     bestOverlap = 0.0
     bestRetro = None
-    fakeRetro = queryChrom, queryBeg, queryEnd, "", ""
-    k = bisect.bisect(retros, fakeRetro)
-    ka = k
-    while ka < len(retros):
-        r = retros[ka]
+    if queryChrom not in index: return bestOverlap, bestRetro
+    retros, nestedList = index[queryChrom]
+    for i in overlappingRetros(nestedList, queryBeg, queryEnd, minOverlap):
+        r = retros[i]
         chrom, beg, end, strand, gene = r
-        if chrom > queryChrom: break
-        if beg >= queryEnd: break
+        counts["retrosScanned"] += 1
         overlap = overlapJaccardIndex(beg, end, queryBeg, queryEnd)
-        if overlap > bestOverlap: bestOverlap, bestRetro = overlap, r
-        ka += 1
-    kb = k
-    while kb > 0:
-        kb -= 1
-        r = retros[kb]
-        chrom, beg, end, strand, gene = r
-        if chrom < queryChrom: break
-        if beg + maxRetroLength <= queryBeg: break
-        overlap = overlapJaccardIndex(beg, end, queryBeg, queryEnd)
-        if overlap > bestOverlap: bestOverlap, bestRetro = overlap, r
+        if overlap > bestOverlap or (overlap == bestOverlap and bestRetro and
+                                     scanRank(i, r, queryBeg, queryEnd) <
+                                     scanRank(bestI, bestRetro,
+                                              queryBeg, queryEnd)):
+            bestOverlap, bestRetro, bestI = overlap, r, i
     return bestOverlap, bestRetro
 
-def bestOverlaps(edges, retros, maxRetroLength, opts):
-    overlaps = {}
-    for j in range(len(edges)):
-        for i in range(j):
+def candidateIntervals(edges):
+    # Get the ]...[ intervals between sorted edges of one rearrangement
+    for j, (jChrom, jPos, jBracket) in enumerate(edges):
+        if jBracket == "]": continue
+        firstOnChrom = bisect.bisect_left(edges, (jChrom,))
+        for i in range(firstOnChrom, j - 1):  # xxx skip i + 1 == j
             iChrom, iPos, iBracket = edges[i]
-            jChrom, jPos, jBracket = edges[j]
-            if iChrom != jChrom: continue
             if iPos == jPos: continue
             if iBracket == "[": continue
-            if jBracket == "]": continue
-            if i + 1 == j: continue  # xxx
-            overlap, retro = bestRetroOverlap(iChrom, iPos, jPos, retros,
-                                              maxRetroLength)
-            if overlap < opts.min_overlap: continue
-            if retro not in overlaps or overlaps[retro] < overlap:
-                overlaps[retro] = overlap
+            yield iChrom, iPos, jPos
+
+def bestOverlaps(intervals, results, opts):
+    overlaps = {}
+    for i in intervals:
+        overlap, retro = results[i]
+        if overlap < opts.min_overlap: continue
+        if retro not in overlaps or overlaps[retro] < overlap:
+            overlaps[retro] = overlap
     return overlaps
 
-def rearrangementRetrofilter(opts, args):
-    retroFile = myOpen(args[0])
-    retroLines = (i for i in retroFile if i[0] != "#")
-    retros = sorted(map(retroseqFromLine, retroLines))
-    maxRetroLength = max(map(retroseqLength, retros))
-
-    for line in myOpen(args[1]):
-        fields = line.split()
-        edgeFields = (i for i in fields if opts.genome in i)
-        edges = sorted(map(edgeFromText, edgeFields))
-        overlaps = bestOverlaps(edges, retros, maxRetroLength, opts)
+def lineBlocks(lines, blockSize):
+    while True:
+        block = list(itertools.islice(lines, blockSize))
+        if not block: break
+        yield block
+
+filterData = None  # shared with worker processes
+
+def setFilterData(*args):
+    global filterData
+    filterData = args
+
+def filteredBlock(block):  # can run in a worker process
+    # Collect candidate intervals from a block of lines, check each
+    # distinct one once, in sorted order, then get the output lines
+    index, opts, isTsv = filterData
+    oldCounts = counts.copy()
+    intervalsPerLine = []
+    for line in block:
+        if isTsv:
+            edges = sorted(tsvEdges(line, opts.genome))
+        else:
+            fields = line.split()
+            edgeFields = (i for i in fields if opts.genome in i)
+            edges = sorted(map(edgeFromText, edgeFields))
+        intervalsPerLine.append(list(candidateIntervals(edges)))
+    results = {}
+    for intervals in intervalsPerLine:
+        counts["candidateIntervals"] += len(intervals)
+        results.update(dict.fromkeys(intervals))
+    for i in sorted(results):
+        chrom, beg, end = i
+        results[i] = bestRetroOverlap(chrom, beg, end, index,
+                                      opts.min_overlap)
+    out = []
+    for line, intervals in zip(block, intervalsPerLine):
+        counts["rearrangements"] += 1
+        overlaps = bestOverlaps(intervals, results, opts)
+        if overlaps: counts["rearrangementsWithOverlaps"] += 1
         if opts.show:
-            for k, v in overlaps.iteritems():
-                print("%#.3g" % v, retroseqText(k), line, end="")
+            for k, v in overlaps.items():
+                for i in (line.splitlines(True) if isTsv else [line]):
+                    out.append("%#.3g %s %s" % (v, retroseqText(k), i))
         else:
             if not overlaps:
-                print(line, end="")
+                out.append(line)
+    return "".join(out), counts - oldCounts
+
+def rearrangementRetrofilter(opts, args):
+    with stage("readRetros"):
+        retroFile = U.myOpen(args[0])
+        retroLines = (i for i in retroFile if i[0] != "#")
+        retros = sorted(map(retroseqFromLine, retroLines))
+        index = retroIndex(retros)
+    counts["retros"] = len(retros)
+
+    with stage("filter"):
+        isTsv, texts = rearrangementTexts(U.myOpen(args[1]))
+        setFilterData(index, opts, isTsv)
+        if isTsv and not opts.show: print(U.tsvHeader)
+        blocks = lineBlocks(texts, 1000)
+        if opts.jobs > 1:  # the workers get the index by fork
+            pool = U.forkPool(opts.jobs, setFilterData, filterData)
+            results = pool.imap(filteredBlock, blocks)
+        else:
+            results = (filteredBlock(i) for i in blocks)
+        for text, blockCounts in results:
+            sys.stdout.write(text)
+            if opts.jobs > 1: counts.update(blockCounts)
+        if opts.jobs > 1:
+            pool.close()
+            pool.join()
 
 if __name__ == "__main__":
     signal.signal(signal.SIGPIPE, signal.SIG_DFL)  # avoid silly error message
@@ -117,6 +253,11 @@ if __name__ == "__main__":
                   help="show the overlaps (default: write rearrangements without overlaps)")
     op.add_option("-g", "--genome", metavar="NAME", default="hg19",
                   help="genome name (default: %default)")
+    op.add_option("-j", "--jobs", metavar="N", type="int", default=1,
+                  help="use N parallel processes (default: %default)")
+    op.add_option("--stats", metavar="FILE",
+                  help="write run times, memory use, and counts to FILE, as JSON")
     opts, args = op.parse_args()
     if len(args) != 2: op.error("I need 2 file names")
     rearrangementRetrofilter(opts, args)
+    if opts.stats: U.writeStats(opts.stats)
@@ -0,0 +1,296 @@
+# Copyright 2016 Martin C. Frith
+
+# Use the rearrangement scripts as a library, with rearrangements as
+# objects instead of text lines.  For example:
+#
+#   import rearrangements as R
+#   r = R.genomeRearrangements("hg19-panTro4.maf", "hg19.gap", "panTro4.gap")
+#   R.findAllEquivalentEdges([R.readRearrangementFile("ref.txt")], r)
+#   r = [i for i in r if R.isSupported(i)]
+#   retros = R.readRetros("retros.tab")
+#   r = [i for i in r if not R.bestOverlaps(i, retros, "hg19")]
+
+from __future__ import print_function
+
+import collections, hashlib, itertools, json, os, pickle, sys
+
+import rearrangementutils as U
+
+def loadScript(name):
+    # The scripts have "-" in their names, so they can't be imported
+    moduleName = name.replace("-", "_")
+    if moduleName in sys.modules: return sys.modules[moduleName]
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        name + ".py")
+    try:
+        import importlib.util
+    except ImportError:  # python2
+        import imp
+        return imp.load_source(moduleName, path)
+    spec = importlib.util.spec_from_file_location(moduleName, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[moduleName] = module  # so worker processes can find it
+    spec.loader.exec_module(module)
+    return module
+
+genomeScript = loadScript("genome-rearrangements")
+supportScript = loadScript("supported-rearrangements")
+retroScript = loadScript("rearrangement-retrofilter")
+splicedScript = loadScript("last-spliced-retroseqs")
+
+class Edge(object):
+    # genome is 1 or 2 (or 0 if unknown), and seqName includes the
+    # genome name, e.g. "hg19.chr2".  support is the number of
+    # references that support this edge.
+    __slots__ = "genome", "seqName", "coordinate", "isStart", "support"
+
+    def __init__(self, genome, seqName, coordinate, isStart, support=0):
+        self.genome = genome
+        self.seqName = seqName
+        self.coordinate = coordinate
+        self.isStart = isStart
+        self.support = support
+
+    def text(self):
+        suffix = "[" if self.isStart else "]"
+        return self.seqName + ":" + str(self.coordinate) + suffix
+
+    def tsvRecord(self, gapLengths):
+        genome, sequence = genomeScript.genomeAndSequence(self.seqName)
+        side = "start" if self.isStart else "end"
+        gapText = ",".join(map(str, gapLengths)) or "."
+        return "\t".join((genome, sequence, str(self.coordinate), side,
+                          gapText))
+
+class Rearrangement(object):
+    # gapLengths[i] has the lengths of the assembly gaps between
+    # edges[i] and edges[i+1]
+    __slots__ = "edges", "gapLengths"
+
+    def __init__(self, edges, gapLengths):
+        self.edges = edges
+        self.gapLengths = gapLengths
+
+    def text(self):
+        out = []
+        for e, g in zip(self.edges, self.gapLengths + [()]):
+            out.append(e.text())
+            if g: out.append("gap" + ",".join(map(str, g)))
+        return " ".join(out)
+
+    def tsvLines(self, rearrangementId):
+        # As genome-rearrangements.py -f tsv, one line per edge
+        return [str(rearrangementId) + "\t" + e.tsvRecord(g)
+                for e, g in zip(self.edges, self.gapLengths + [()])]
+
+def rearrangementFromLinkedEdges(linkedEdges, gaps):
+    edges = [Edge(x[1], x[2], x[3], x[4] == "start") for x in linkedEdges]
+    gapLengths = []
+    for x, y in zip(linkedEdges, linkedEdges[1:]):
+        if x[1] == y[1]:
+            g = genomeScript.gapsBetween(x, y, gaps)
+            gapLengths.append(tuple(map(genomeScript.gapLength, g)))
+        else:
+            gapLengths.append(())
+    return Rearrangement(edges, gapLengths)
+
+def rearrangementFromText(line):
+    # Read a line of genome-rearrangements.py output (or of
+    # supported-rearrangements.py -a output).  The text doesn't say
+    # which genome is 1 and which is 2.
+    edges = []
+    gapLengths = []
+    for i in line.split():
+        if i.startswith("gap"):
+            gapLengths[-1] = tuple(int(j) for j in i[3:].split(","))
+        else:
+            seqName, tail = i.rstrip("$01").split(":")
+            edges.append(Edge(0, seqName, int(tail[:-1]), tail[-1] == "["))
+            gapLengths.append(())
+    return Rearrangement(edges, gapLengths[:-1])
+
+def rearrangementFromTsv(lines):
+    # Read the lines of one rearrangement, in genome-rearrangements.py
+    # -f tsv format (or supported-rearrangements.py -a output, which
+    # adds a column with the support marks)
+    edges = []
+    gapLengths = []
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        genome, sequence, coordinate, side, gapText = fields[1:6]
+        seqName = genome + "." + sequence if genome else sequence
+        support = 0
+        if len(fields) > 6 and fields[6] != ".":
+            support = max(fields[6].count("1"), 1)
+        edges.append(Edge(0, seqName, int(coordinate), side == "start",
+                          support))
+        if gapText == ".": gapLengths.append(())
+        else: gapLengths.append(tuple(int(i) for i in gapText.split(",")))
+    return Rearrangement(edges, gapLengths[:-1])
+
+def rearrangementsFromLines(lines):
+    # Read genome-rearrangements.py output, in text or TSV format
+    lines = iter(lines)
+    head = next(lines, "")
+    if head.startswith(U.tsvHeader):
+        for k, v in itertools.groupby(lines, U.tsvId):
+            yield rearrangementFromTsv(v)
+    else:
+        for i in itertools.chain([head] if head else [], lines):
+            yield rearrangementFromText(i)
+
+def readRearrangementFile(fileName):
+    return list(rearrangementsFromLines(U.myOpen(fileName)))
+
+def writeRearrangements(rearrangements, outputFormat="text",
+                        outFile=sys.stdout):
+    if outputFormat == "tsv":
+        print(U.tsvHeader, file=outFile)
+        for n, r in enumerate(rearrangements):
+            for i in r.tsvLines(n + 1):
+                print(i, file=outFile)
+    else:
+        for r in rearrangements:
+            print(r.text(), file=outFile)
+
+def readGaps(fileName, cacheDir=None):
+    # Get all gaps and unordered gaps, as genome-rearrangements.py does
+    if cacheDir: return genomeScript.cachedGaps(cacheDir, fileName)
+    return genomeScript.getGaps(fileName)
+
+def genomeRearrangements(mafFileName, gap1=None, gap2=None, maxMismap=1e-5,
+                         maxDistance=1e9, numOfJobs=1, cacheDir=None):
+    # Same rearrangements, in the same order, as genome-rearrangements.py
+    gaps1, unorderedGaps1 = readGaps(gap1, cacheDir)
+    gaps2, unorderedGaps2 = readGaps(gap2, cacheDir)
+    gaps = gaps1, gaps2
+    unorderedGaps = unorderedGaps1, unorderedGaps2
+    if cacheDir and mafFileName != '-':
+        table = genomeScript.cachedEdgeTable(cacheDir, mafFileName, numOfJobs)
+        table = genomeScript.edgeTableWithMaxMismap(table, maxMismap)
+    else:
+        table = genomeScript.edgeTableFromMaf(mafFileName, maxMismap,
+                                              numOfJobs)
+    r = genomeScript.rearrangementsFromTable(table, maxDistance, gaps,
+                                             unorderedGaps)
+    return [rearrangementFromLinkedEdges(i, gaps) for i in r]
+
+def sortedEdgeLists(rearrangements):
+    # Get each sequence's edges, in the [coordinate, isStart, -1] form
+    # that supported-rearrangements.py matches, and the Edge objects in
+    # the same order
+    edges = collections.defaultdict(list)
+    for r in rearrangements:
+        for e in r.edges:
+            edges[e.seqName].append(e)
+    lists = {}
+    for seqName, v in edges.items():
+        v.sort(key=lambda e: (e.coordinate, e.isStart))
+        lists[seqName] = [[e.coordinate, e.isStart, -1] for e in v], v
+    return lists
+
+def findAllEquivalentEdges(references, rearrangements, maxDistance=1000):
+    # Count, in edge.support, the references (each one a list of
+    # Rearrangements) with an equivalent edge
+    queryLists = sortedEdgeLists(rearrangements)
+    queryEdges = dict((k, v[0]) for k, v in queryLists.items())
+    for reference in references:
+        refLists = sortedEdgeLists(reference)
+        refEdges = dict((k, v[0]) for k, v in refLists.items())
+        for v in queryEdges.values():
+            for i in v:
+                i[2] = -1
+        supportScript.findAllEquivalentEdges(refEdges, queryEdges,
+                                             maxDistance)
+        for k, (v, edgeObjects) in queryLists.items():
+            for i, e in zip(v, edgeObjects):
+                if i[2] >= 0: e.support += 1
+
+def isSupported(rearrangement, minRefs=1):
+    # As supported-rearrangements.py: are half the edges (i.e. the ones
+    # in the genome the references share) supported by minRefs references?
+    n = len(rearrangement.edges)
+    s = sum(1 for e in rearrangement.edges if e.support >= minRefs)
+    return s == n // 2
+
+def readRetros(fileName):
+    # Get an index of retrosequences from a retros.tab file
+    lines = (i for i in U.myOpen(fileName) if i[0] != "#")
+    return retroIndex(map(retroScript.retroseqFromLine, lines))
+
+def retroIndex(retros):
+    # retros are (chromosome, beg, end, strand, gene) tuples
+    return retroScript.retroIndex(sorted(retros))
+
+def bestOverlaps(rearrangement, retroIndex, genomeName, minOverlap=0.9):
+    # Get {retro: Jaccard index} for retros overlapping the
+    # rearrangement, as rearrangement-retrofilter.py does
+    edges = []
+    for e in rearrangement.edges:
+        if e.seqName.split(".")[0] != genomeName: continue
+        genome, chrom = e.seqName.split(".")
+        edges.append((chrom, e.coordinate, "[" if e.isStart else "]"))
+    edges.sort()
+    overlaps = {}
+    for chrom, beg, end in retroScript.candidateIntervals(edges):
+        overlap, retro = retroScript.bestRetroOverlap(chrom, beg, end,
+                                                      retroIndex, minOverlap)
+        if overlap < minOverlap: continue
+        if retro not in overlaps or overlaps[retro] < overlap:
+            overlaps[retro] = overlap
+    return overlaps
+
+def readGenes(fileName, cacheDir=None):
+    # Get a junction index of the genes in a PSL file
+    if cacheDir and fileName != '-':
+        return splicedScript.cachedJunctionIndex(cacheDir, fileName)
+    return splicedScript.junctionIndex(
+        splicedScript.readGenes(U.myOpen(fileName)))
+
+def splicedRetroseqs(junctionIndex, lastFileNames):
+    # Get (chromosome, beg, end, strand, gene) tuples of spliced
+    # retrosequences, from LAST tabular files, as last-spliced-retroseqs.py
+    names, qSizes, junctionEnds, junctions = junctionIndex
+    genes = dict((name.encode(), i) for i, name in enumerate(names))
+    splicedScript.setFilterData(genes, qSizes, junctionEnds, junctions)
+    for chunk in splicedScript.lineChunks(lastFileNames):
+        text, chunkCounts = splicedScript.filteredChunk(chunk)
+        for line in text.decode().splitlines():
+            if line[0] != "#": yield retroScript.retroseqFromLine(line)
+
+def cachedStage(cacheDir, stageName, key, compute):
+    # Get a stage's output from cacheDir, if it was computed with the
+    # same key (inputs and parameters), else compute and cache it.
+    # Python 2 can't read Python 3 pickles, so they're cached separately.
+    if not cacheDir or key is None: return compute()
+    keyText = json.dumps([stageName, key, sys.version_info[0]], sort_keys=True)
+    digest = hashlib.sha1(keyText.encode()).hexdigest()
+    path = os.path.join(cacheDir, "%s.%s.pickle" % (stageName, digest))
+    try:
+        f = open(path, "rb")
+    except EnvironmentError:
+        pass
+    else:
+        value = pickle.load(f)
+        f.close()
+        return value
+    value = compute()
+    if not os.path.isdir(cacheDir): os.makedirs(cacheDir)
+    tmpPath = path + ".tmp%d" % os.getpid()
+    f = open(tmpPath, "wb")
+    pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+    f.close()
+    os.rename(tmpPath, path)  # so that readers never see a partial file
+    return value
+
+def fileSignature(fileName):
+    # None means "can't be cached", e.g. for stdin or a pipe
+    if not fileName: return ""
+    if not U.isRegularFile(fileName): return None
+    return U.inputSignature(fileName)
+
+def stageKey(**kwargs):
+    if None in kwargs.values(): return None
+    for v in kwargs.values():
+        if isinstance(v, list) and None in v: return None
+    return kwargs
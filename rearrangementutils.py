@@ -0,0 +1,283 @@
+# Copyright 2016 Martin C. Frith
+
+# Code shared by the rearrangement scripts: reading (possibly
+# compressed) input files, the TSV format, and run statistics.
+
+from __future__ import print_function
+
+import array, collections, contextlib, ctypes, gzip, hashlib, io, itertools
+import json, mmap, multiprocessing, multiprocessing.pool, os, resource
+import shutil, struct, sys, time, zlib
+
+def myOpen(fileName):  # faster than fileinput
+    # Open the file once, and peek at it, so that pipes work
+    f = binaryInput(fileName)
+    if compressionOf(f): f = decompressedStream(f)
+    elif fileName == '-' and str is not bytes: return sys.stdin
+    if str is bytes: return f
+    return io.TextIOWrapper(f)
+
+def myOpenBytes(fileName):
+    f = binaryInput(fileName)
+    if compressionOf(f): return decompressedStream(f)
+    return f
+
+def isRegularFile(fileName):  # not stdin or a pipe
+    return fileName != '-' and os.path.isfile(fileName)
+
+def mmapOrNone(fileName, access=mmap.ACCESS_READ):
+    # Memory-map an uncompressed regular file, without reading it first
+    if not isRegularFile(fileName): return None
+    f = io.open(fileName, "rb")
+    try:
+        buf = mmap.mmap(f.fileno(), 0, access=access)
+    except (EnvironmentError, ValueError):  # e.g. empty file
+        return None
+    finally:
+        f.close()
+    if buf[:2] != b"\x1f\x8b": return buf
+    buf.close()  # gzip or BGZF
+    return None
+
+# gzip and BGZF inputs are decompressed on the fly.  BGZF (as made by
+# bgzip) is a series of small gzip blocks: batches of them are
+# decompressed on a thread pool, which zlib lets run in parallel.
+bgzfThreads = multiprocessing.cpu_count()
+
+def binaryInput(fileName):  # a binary stream that can peek
+    if fileName != '-': return io.open(fileName, "rb")
+    if str is not bytes: return sys.stdin.buffer
+    return io.open(sys.stdin.fileno(), "rb", closefd=False)
+
+def isBgzfHead(head):
+    return head[:4] == b"\x1f\x8b\x08\x04" and head[12:14] == b"BC"
+
+def compressionOf(f):
+    head = f.peek(18)[:18]
+    if isBgzfHead(head): return "bgzf"
+    if head[:2] == b"\x1f\x8b": return "gzip"
+    return None
+
+def bgzfBlocks(f):
+    # Yield the raw compressed data of each BGZF block
+    while 1:
+        head = f.read(18)
+        if not head: break
+        if not isBgzfHead(head): raise Exception("bad BGZF block")
+        blockSize = struct.unpack("<H", head[16:18])[0] + 1
+        yield f.read(blockSize - 18)[:-8]  # omit the CRC and size
+
+def inflatedBlocks(blocks):
+    return b"".join([zlib.decompress(i, -15) for i in blocks])
+
+def bgzfChunks(f):
+    # Keep a few batches in flight, and yield them in order
+    pool = multiprocessing.pool.ThreadPool(bgzfThreads)
+    blocks = bgzfBlocks(f)
+    pending = collections.deque()
+    while 1:
+        batch = list(itertools.islice(blocks, 64))
+        if batch: pending.append(pool.apply_async(inflatedBlocks, (batch,)))
+        if not pending: break
+        if not batch or len(pending) > 2 * bgzfThreads:
+            yield pending.popleft().get()
+    pool.close()
+
+def gzipChunks(f):
+    # This handles several gzip members, e.g. from cat
+    d = zlib.decompressobj(31)
+    while 1:
+        data = d.unused_data or f.read(1 << 20)
+        if not data: break
+        if d.unused_data: d = zlib.decompressobj(31)
+        yield d.decompress(data)
+
+class ChunkStream(io.RawIOBase):
+    # A readable binary stream of the data in an iterable of chunks
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self.chunk):
+            chunk = next(self.chunks, None)
+            if chunk is None: return 0
+            self.chunk = memoryview(chunk)
+        n = min(len(b), len(self.chunk))
+        b[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+def decompressedStream(f):
+    chunks = bgzfChunks(f) if compressionOf(f) == "bgzf" else gzipChunks(f)
+    return io.BufferedReader(ChunkStream(chunks), 1 << 16)
+
+# Compressed copies of files, for the benchmark and test scripts
+
+def writeGzip(inFileName, outFileName):
+    f = open(inFileName, "rb")
+    out = gzip.open(outFileName, "wb")
+    shutil.copyfileobj(f, out)
+    out.close()
+
+def bgzfBlock(data):
+    c = zlib.compressobj(6, zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+    head = (b"\x1f\x8b\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0" +
+            struct.pack("<H", len(cdata) + 25))
+    tail = struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+    return head + cdata + tail
+
+def writeBgzf(inFileName, outFileName):  # like bgzip
+    f = open(inFileName, "rb")
+    out = open(outFileName, "wb")
+    while 1:
+        data = f.read(65280)
+        if not data: break
+        out.write(bgzfBlock(data))
+    out.write(bgzfBlock(b""))  # end-of-file marker
+    out.close()
+
+def forkPool(numOfProcesses, initializer, initargs):
+    # The workers get the initargs by fork, not by pickling, because
+    # they may be memory-mapped cache columns, which can't be pickled
+    if not hasattr(multiprocessing, "get_context"):  # python2: always fork
+        return multiprocessing.Pool(numOfProcesses, initializer, initargs)
+    context = multiprocessing.get_context("fork")
+    return context.Pool(numOfProcesses, initializer, initargs)
+
+# A cache file has a magic line, a JSON header line, then columns, each
+# padded to 8 bytes so that it can be used straight from the mmap
+
+def inputSignature(fileName):
+    fileName = os.path.abspath(fileName)
+    st = os.stat(fileName)
+    sampleSize = 1 << 16
+    h = hashlib.sha1()
+    f = open(fileName, "rb")
+    for k in range(17):
+        f.seek(max(0, min(st.st_size * k // 16, st.st_size - sampleSize)))
+        h.update(f.read(sampleSize))
+    f.close()
+    return {"path": fileName, "size": st.st_size, "mtime": st.st_mtime,
+            "hash": h.hexdigest()}
+
+def cachePath(cacheDir, fileName, kind):
+    key = hashlib.sha1(os.path.abspath(fileName).encode()).hexdigest()
+    return os.path.join(cacheDir, key + "." + kind)
+
+def columnBytes(column):
+    if isinstance(column, bytearray): return bytes(column)
+    if hasattr(column, "tobytes"): return column.tobytes()
+    return column.tostring()
+
+# Python2's memoryview can't be cast, so the columns are ctypes arrays
+# there, which use the mmap's memory too
+ctypesOfTypecode = {"i": ctypes.c_int, "l": ctypes.c_long,
+                    "B": ctypes.c_ubyte, "d": ctypes.c_double}
+
+# ctypes needs a writable mmap, e.g. ACCESS_COPY, which copies nothing
+# unless it's written to
+if hasattr(memoryview, "cast"): columnAccess = mmap.ACCESS_READ
+else: columnAccess = mmap.ACCESS_COPY
+
+def columnFromBuffer(buf, typecode, beg, end):  # no copying
+    if hasattr(memoryview, "cast"):
+        return memoryview(buf)[beg:end].cast(typecode)
+    ctype = ctypesOfTypecode[typecode]
+    size = (end - beg) // ctypes.sizeof(ctype)
+    return (ctype * size).from_buffer(buf, beg)
+
+def mappedColumn(buf, typecode):
+    return columnFromBuffer(buf, typecode, 0, len(buf))
+
+def extendColumn(column, source, beg, end):
+    # Append source[beg:end] to an array or bytearray.  A slice of a
+    # ctypes array is a list, which is slow, so copy its bytes instead.
+    if not isinstance(source, ctypes.Array):
+        column.extend(source[beg:end])
+        return
+    itemSize = ctypes.sizeof(source._type_)
+    data = ctypes.string_at(ctypes.addressof(source) + beg * itemSize,
+                            (end - beg) * itemSize)
+    if isinstance(column, bytearray): column.extend(data)
+    else: column.fromstring(data)
+
+def paddedSize(size):
+    return (size + 7) // 8 * 8
+
+def writeCache(path, magic, header, columns):
+    header = dict(header)
+    header["columns"] = [(name, typecode, array.array(typecode).itemsize,
+                          len(column)) for name, typecode, column in columns]
+    head = magic + json.dumps(header).encode() + b"\n"
+    cacheDir = os.path.dirname(path)
+    if cacheDir and not os.path.isdir(cacheDir): os.makedirs(cacheDir)
+    tmpPath = path + ".tmp%d" % os.getpid()
+    f = open(tmpPath, "wb")
+    f.write(head.ljust(paddedSize(len(head))))
+    for name, typecode, column in columns:
+        data = columnBytes(column)
+        f.write(data.ljust(paddedSize(len(data)), b"\0"))
+    f.close()
+    os.rename(tmpPath, path)  # so that readers never see a partial file
+
+def readCache(path, magic, signature):
+    # Return the header and columns, or None if absent or stale
+    try: buf = mmapOrNone(path, columnAccess)
+    except EnvironmentError: return None
+    if buf is None or buf[:len(magic)] != magic: return None
+    headEnd = buf.find(b"\n", len(magic)) + 1
+    header = json.loads(buf[len(magic):headEnd].decode())
+    for k, v in signature.items():
+        if header.get(k) != v: return None
+    columns = {}
+    beg = paddedSize(headEnd)
+    for name, typecode, itemSize, count in header["columns"]:
+        if array.array(typecode).itemsize != itemSize: return None
+        end = beg + itemSize * count
+        columns[name] = columnFromBuffer(buf, typecode, beg, end)
+        beg = paddedSize(end)
+    return header, columns
+
+# With -f tsv, each rearrangement is written as one line per edge, with
+# these fixed columns.  "gaps" has the lengths of the assembly gaps
+# between this edge and the next edge of the rearrangement, or ".".
+tsvHeader = "#id\tgenome\tsequence\tcoordinate\tside\tgaps"
+
+def tsvId(line):  # the rearrangement that a TSV line belongs to
+    return line[:line.index("\t")]
+
+# Run statistics, written as JSON by the --stats option
+stageStats = []
+counts = collections.Counter()
+
+def peakRssKb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin": rss //= 1024  # it's in bytes on macOS
+    return rss
+
+def cpuSeconds():  # including child processes that have finished
+    return sum(os.times()[:4])
+
+@contextlib.contextmanager
+def stage(name):
+    wall = time.time()
+    cpu = cpuSeconds()
+    yield
+    stageStats.append({"stage": name,
+                       "wallSeconds": round(time.time() - wall, 3),
+                       "cpuSeconds": round(cpuSeconds() - cpu, 3),
+                       "peakRssKb": peakRssKb()})
+
+def writeStats(fileName, **moreStats):
+    report = {"program": os.path.basename(sys.argv[0]),
+              "stages": stageStats, "counts": counts}
+    report.update(moreStats)
+    out = open(fileName, "w")
+    json.dump(report, out, indent=1, sort_keys=True)
+    out.write("\n")
+    out.close()
@@ -1,16 +1,19 @@
 #! /usr/bin/env python
 # Copyright 2016 Martin C. Frith
 
-# Read 2 files of genome rearrangements: write the 2nd file,
-# indicating which breaks are supported by the 1st file.
+# Read files of genome rearrangements: write the last file,
+# indicating which breaks are supported by the other files.
 
 from __future__ import print_function
 
-import bisect, collections, optparse, signal, sys
+import array, bisect, collections, heapq, itertools, optparse, signal
+import sys
 
-def myOpen(fileName):  # faster than fileinput
-    if fileName == '-': return sys.stdin
-    else:               return open(fileName)
+import rearrangementutils as U
+
+# Run statistics, written as JSON by the --stats option
+counts = U.counts
+stage = U.stage
 
 def isEdgeString(s):
     return s.count(":") == 1  # xxx ???
@@ -21,8 +24,47 @@ def edgeFromString(s):
     isStart = tail[-1] == "["
     return chromosomeName, coordinate, isStart
 
+def textRearrangements(lines):
+    # Yield each rearrangement's text, fields, and edges, where each
+    # edge is: field index, chromosome name, coordinate, isStart
+    for line in lines:
+        fields = line.split()
+        edges = [(j,) + edgeFromString(i)
+                 for j, i in enumerate(fields) if isEdgeString(i)]
+        yield line, fields, edges
+
+def tsvEdge(record):
+    genome, sequence, coordinate, side = record.split("\t", 5)[1:5]
+    chromosomeName = genome + "." + sequence if genome else sequence
+    return chromosomeName, int(coordinate), side == "start"
+
+def tsvRearrangements(lines):
+    # The same, from TSV lines: the fields are the lines of one
+    # rearrangement, read straight into edges without looking for them
+    for k, group in itertools.groupby(lines, U.tsvId):
+        fields = [i.rstrip("\n") for i in group]
+        edges = [(j,) + tsvEdge(i) for j, i in enumerate(fields)]
+        yield "".join(i + "\n" for i in fields), fields, edges
+
+def rearrangementsFromLines(lines):
+    # Get whether the lines are in TSV format, and their rearrangements
+    lines = iter(lines)
+    head = next(lines, "")
+    if head.startswith(U.tsvHeader): return True, tsvRearrangements(lines)
+    lines = itertools.chain([head] if head else [], lines)
+    return False, textRearrangements(lines)
+
 def edgesFromLines(lines):
     edges = collections.defaultdict(list)
+    lines = iter(lines)
+    head = next(lines, "")
+    if head.startswith(U.tsvHeader):  # one edge per line
+        for line in lines:
+            chromosomeName, coordinate, isStart = tsvEdge(line)
+            edges[chromosomeName].append([coordinate, isStart, -1])
+        lines = []
+    elif head:
+        lines = itertools.chain([head], lines)
     for line in lines:
         w = line.split()
         for i in w:
@@ -30,88 +72,274 @@ def edgesFromLines(lines):
                 chromosomeName, coordinate, isStart = edgeFromString(i)
                 v = [coordinate, isStart, -1]
                 edges[chromosomeName].append(v)
-    for i in edges.itervalues():
+    for i in edges.values():
         i.sort()
     return edges
 
+def sameTypeColumns(edges):
+    # for each edge type: the indices and coordinates of those edges
+    columns = {False: ([], []), True: ([], [])}
+    for i, e in enumerate(edges):
+        coordinate, isStart, junk = e
+        indices, coordinates = columns[isStart]
+        indices.append(i)
+        coordinates.append(coordinate)
+    return columns
+
+def nearestEdge(columns, coordinate, isStart, beg, end):
+    # Get (distance, index) of the nearest edge of the same type, with
+    # index in [beg, end).  Ties go to the lowest index.
+    indices, coordinates = columns[isStart]
+    lo = bisect.bisect_left(indices, beg)
+    hi = bisect.bisect_left(indices, end, lo)
+    k = bisect.bisect_left(coordinates, coordinate, lo, hi)
+    nearest = None
+    if k > lo:
+        c = coordinates[k - 1]
+        j = bisect.bisect_left(coordinates, c, lo, k)
+        nearest = coordinate - c, indices[j]
+    if k < hi:
+        after = coordinates[k] - coordinate, indices[k]
+        if nearest is None or after < nearest: nearest = after
+    return nearest
+
+class PairedIndices(object):
+    # The sorted indices of paired edges, in a Fenwick tree, so that
+    # adding one, and finding the nearest ones, take O(log n) time
+    def __init__(self, size):
+        self.topBit = 1 << size.bit_length() >> 1
+        self.tree = [0] * (2 * self.topBit + 1)
+        self.count = 0
+
+    def add(self, i):
+        tree = self.tree
+        self.count += 1
+        i += 1
+        while i < len(tree):
+            tree[i] += 1
+            i += i & -i
+
+    def rank(self, i):  # how many are < i
+        tree = self.tree
+        n = 0
+        while i:
+            n += tree[i]
+            i -= i & -i
+        return n
+
+    def nth(self, n):  # the nth smallest, counting from 0
+        tree = self.tree
+        i = 0
+        bit = self.topBit
+        while bit:
+            j = i + bit
+            if tree[j] <= n:
+                i = j
+                n -= tree[j]
+            bit >>= 1
+        return i
+
+def allowedRange(paired, edges1, i1, numOfEdges2):
+    # Paired edges can't cross: edges1[i1] can only pair with edges2
+    # between the partners of the nearest paired edges1 on each side
+    k = paired.rank(i1)
+    beg2 = edges1[paired.nth(k - 1)][2] + 1 if k else 0
+    end2 = edges1[paired.nth(k)][2] if k < paired.count else numOfEdges2
+    return beg2, end2
+
+def pushNearestEdge(heap, columns2, i1, edge1, beg2, end2, maxDistance):
+    coordinate, isStart, junk = edge1
+    nearest = nearestEdge(columns2, coordinate, isStart, beg2, end2)
+    if nearest and nearest[0] <= maxDistance:
+        distance, i2 = nearest
+        heapq.heappush(heap, (distance, i1, i2))
+
 def findEquivalentEdges(edges1, edges2, maxDistance):
-    minDistance = maxDistance + 1
-    i1best = -1
-    i2best = -1
-    beg2 = 0
-    for i1, e1 in enumerate(edges1):
-        coordinate1, isStart1, junk1 = e1
-        i2 = beg2
-        while i2 < len(edges2):
-            e2 = edges2[i2]
-            coordinate2, isStart2, junk2 = e2
-            if isStart1 == isStart2:
-                distance = abs(coordinate1 - coordinate2)
-                if distance < minDistance:
-                    minDistance = distance
-                    i1best = i1
-                    i2best = i2
-                if coordinate2 <= coordinate1: beg2 = i2 + 1
-                if coordinate2 >= coordinate1: break
-            i2 += 1
-    if minDistance <= maxDistance:
-        edges1[i1best][2] = i2best
-        edges2[i2best][2] = i1best
-        findEquivalentEdges(edges1[:i1best], edges2[:i2best], maxDistance)
-        i1next = i1best + 1
-        i2next = i2best + 1
-        findEquivalentEdges(edges1[i1next:], edges2[i2next:], maxDistance)
+    # Pair up edges of the same type (start or end), closest first, such
+    # that pairs never cross.  Ties go to the lowest index in edges1,
+    # then in edges2.  The heap holds one candidate partner for each
+    # unpaired edge in edges1: when a candidate is no longer allowed,
+    # the next-nearest one is pushed instead.
+    columns2 = sameTypeColumns(edges2)
+    paired = PairedIndices(len(edges1))  # paired edges in edges1
+    heap = []
+    for i1, edge1 in enumerate(edges1):
+        pushNearestEdge(heap, columns2, i1, edge1, 0, len(edges2),
+                        maxDistance)
+    while heap:
+        distance, i1, i2 = heapq.heappop(heap)
+        beg2, end2 = allowedRange(paired, edges1, i1, len(edges2))
+        if beg2 <= i2 < end2:
+            edges1[i1][2] = i2
+            edges2[i2][2] = i1
+            paired.add(i1)
+        else:
+            pushNearestEdge(heap, columns2, i1, edges1[i1], beg2, end2,
+                            maxDistance)
 
 def findAllEquivalentEdges(edgeDict1, edgeDict2, maxDistance):
     for k in edgeDict1:
         if k in edgeDict2:
             findEquivalentEdges(edgeDict1[k], edgeDict2[k], maxDistance)
 
-def isSupported(edgeString, edgeDict):
-    chromosomeName, coordinate, isStart = edgeFromString(edgeString)
-    e = edgeDict[chromosomeName]
-    v = [coordinate, isStart, -2]
-    k = bisect.bisect(e, v)
-    assert k < len(e)
-    assert e[k][0] == coordinate
-    assert e[k][1] == isStart
-    return e[k][2] >= 0
-
-def annotatedFields(fields, edgeDict):
-    for i in fields:
-        if isEdgeString(i) and isSupported(i, edgeDict):
-            i += "$"
-        yield i
+class QueryRearrangements(object):
+    # The query, parsed once.  Edges are numbered in order of appearance,
+    # so rearrangement n has edges lineEnds[n-1] to lineEnds[n].
+    def __init__(self, lines, isKeepFields):
+        self.records = []  # split fields if isKeepFields, else texts
+        self.lineEnds = array.array("l")
+        self.edgeFields = array.array("i")  # field index of each edge
+        self.edges = collections.defaultdict(list)
+        self.serials = collections.defaultdict(list)
+        self.isTsv, rearrangements = rearrangementsFromLines(lines)
+        for text, fields, edges in rearrangements:
+            for j, chromosomeName, coordinate, isStart in edges:
+                self.edges[chromosomeName].append([coordinate, isStart, -1])
+                self.serials[chromosomeName].append(len(self.edgeFields))
+                self.edgeFields.append(j)
+            self.lineEnds.append(len(self.edgeFields))
+            self.records.append(fields if isKeepFields else text)
+        for k, v in self.edges.items():  # sort as edgesFromLines does
+            order = sorted(range(len(v)), key=v.__getitem__)
+            serials = self.serials[k]
+            self.edges[k] = [v[i] for i in order]
+            self.serials[k] = [serials[i] for i in order]
 
-def supportedRearrangements(opts, args):
-    refInput = myOpen(args[0])
-    refEdges = edgesFromLines(refInput)
-    queryLines = list(myOpen(args[1]))
-    queryEdges = edgesFromLines(queryLines)
-    findAllEquivalentEdges(refEdges, queryEdges, opts.distance)
-    for line in queryLines:
-        fields = line.split()
+queryEdges = None  # shared with worker processes
+
+def setQueryEdges(edges):
+    global queryEdges
+    queryEdges = edges
+
+def supportedEdgeIndices(args):  # can run in a worker process
+    refFileName, maxDistance = args
+    refEdges = edgesFromLines(U.myOpen(refFileName))
+    for v in queryEdges.values():
+        for i in v:
+            i[2] = -1
+    findAllEquivalentEdges(refEdges, queryEdges, maxDistance)
+    supported = dict((k, [j for j, i in enumerate(v) if i[2] >= 0])
+                     for k, v in queryEdges.items())
+    return edgeCount(refEdges), supported
+
+def supportMasks(opts, refFileNames, query):
+    # Get bit-masks of the references that support each query edge
+    masks = [0] * len(query.edgeFields)
+    jobs = [(i, opts.distance) for i in refFileNames]
+    if opts.jobs > 1 and len(jobs) > 1 and "-" not in refFileNames:
+        pool = U.forkPool(opts.jobs, setQueryEdges, (queryEdges,))
+        results = pool.map(supportedEdgeIndices, jobs)
+        pool.close()
+        pool.join()
+    else:
+        results = map(supportedEdgeIndices, jobs)
+    for bit, (refEdgeCount, supported) in enumerate(results):
+        counts["referenceEdges"] += refEdgeCount
+        for k, v in supported.items():
+            serials = query.serials[k]
+            for i in v:
+                masks[serials[i]] |= 1 << bit
+    return masks
+
+def bitCount(x):
+    return bin(x).count("1")
+
+def supportMark(mask, numOfRefs):
+    if not mask: return ""
+    if numOfRefs == 1: return "$"
+    return "$" + "".join("01"[mask >> i & 1] for i in range(numOfRefs))
+
+def edgeCount(edgeDict):
+    return sum(len(i) for i in edgeDict.values())
+
+writeData = None  # shared with worker processes
+
+def setWriteData(*args):
+    global writeData
+    writeData = args
+
+def outputText(lineRange):  # can run in a worker process
+    query, masks, isSupported, numOfRefs, opts = writeData
+    lineBeg, lineEnd = lineRange
+    out = []
+    numOfLinesWritten = 0
+    beg = query.lineEnds[lineBeg - 1] if lineBeg else 0
+    for j in range(lineBeg, lineEnd):
+        record = query.records[j]
+        end = query.lineEnds[j]
         if opts.all:
-            w = annotatedFields(fields, queryEdges)
-            print(*w)
+            for i in range(beg, end):
+                mark = supportMark(masks[i] if isSupported[i] else 0,
+                                   numOfRefs)
+                if query.isTsv: mark = "\t" + (mark or ".")
+                record[query.edgeFields[i]] += mark
+            out.append(("\n" if query.isTsv else " ").join(record) + "\n")
         else:
-            edgeStrings = filter(isEdgeString, fields)
-            n = len(edgeStrings)
+            n = end - beg
             assert n % 2 == 0  # xxx
-            s = sum(1 for i in edgeStrings if isSupported(i, queryEdges))
+            s = sum(isSupported[beg:end])
             assert s <= n // 2
-            if s == n // 2: print(line, end="")
+            if s == n // 2:
+                numOfLinesWritten += 1
+                out.append(record)
+        beg = end
+    return "".join(out), numOfLinesWritten
+
+def supportedRearrangements(opts, args):
+    refFileNames = args[:-1]
+    numOfRefs = len(refFileNames)
+    with stage("readQuery"):
+        query = QueryRearrangements(U.myOpen(args[-1]), opts.all)
+        setQueryEdges(query.edges)
+    counts["referenceFiles"] = numOfRefs
+    counts["queryEdges"] = len(query.edgeFields)
+    counts["queryLines"] = len(query.records)
+    with stage("findEquivalentEdges"):
+        masks = supportMasks(opts, refFileNames, query)
+    isSupported = bytearray(bitCount(i) >= opts.min_refs for i in masks)
+    counts["supportedQueryEdges"] = sum(isSupported)
+    with stage("write"):
+        if query.isTsv:
+            print(U.tsvHeader + ("\tsupport" if opts.all else ""))
+        setWriteData(query, masks, isSupported, numOfRefs, opts)
+        numOfLines = len(query.records)
+        chunks = [(i, min(i + 10000, numOfLines))
+                  for i in range(0, numOfLines, 10000)]
+        if opts.jobs > 1 and len(chunks) > 1:  # workers get the data by fork
+            pool = U.forkPool(opts.jobs, setWriteData, writeData)
+            results = pool.imap(outputText, chunks)
+        else:
+            results = map(outputText, chunks)
+        for text, numOfLinesWritten in results:
+            sys.stdout.write(text)
+            counts["linesWritten"] += numOfLinesWritten
+        if opts.jobs > 1 and len(chunks) > 1:
+            pool.close()
+            pool.join()
 
 if __name__ == "__main__":
     signal.signal(signal.SIGPIPE, signal.SIG_DFL)  # avoid silly error message
-    usage = "%prog ref-rearrangements query-rearrangements"
+    usage = "%prog ref-rearrangements [more-ref-rearrangements] query-rearrangements"
     description = 'Write "query" rearrangements that are supported by "reference" rearrangements.'
     op = optparse.OptionParser(usage=usage, description=description)
     op.add_option("-a", "--all", action="store_true",
-                  help="write all query rearrangements, with '$' at supported edges")
+                  help="write all query rearrangements, with '$' at edges supported "
+                  "by at least K references "
+                  "(followed by a 0/1 flag per reference, if there are several), "
+                  "or for TSV input, in an extra column")
     op.add_option("-d", "--distance", metavar="BASES",
                   type="int", default=1000, help=
                   "maximum distance to supporting edge (default: %default)")
+    op.add_option("-k", "--min-refs", metavar="K",
+                  type="int", default=1, help="an edge is supported if it is "
+                  "supported by at least K references (default: %default)")
+    op.add_option("-j", "--jobs", metavar="N", type="int", default=1,
+                  help="use N parallel processes (default: %default)")
+    op.add_option("-s", "--stats", metavar="FILE",
+                  help="write run times, memory use, and counts to FILE, as JSON")
     opts, args = op.parse_args()
-    if len(args) != 2: op.error("I need 2 file names")
+    if len(args) < 2: op.error("I need at least 2 file names")
+    if not 1 <= opts.min_refs < len(args):
+        op.error("option -k must be between 1 and the number of references")
     supportedRearrangements(opts, args)
+    if opts.stats: U.writeStats(opts.stats)